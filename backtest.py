@@ -0,0 +1,59 @@
+import logging
+import argparse
+import json
+from datetime import datetime, timedelta
+
+from src.backtest import Backtest
+from src.coinbase import Coinbase, Currency
+from src.candle_store import CandleStore
+from src.candles import Candles
+from src.logsetup import LogSetup
+
+# Argparse
+parser = argparse.ArgumentParser(description="Replay the webhook alert rules over historical prices for a grid of parameters")
+parser.add_argument("--pair", "-p", default="BTC-USD",
+                    help="Currency pair to test (eg. ETH-EUR)")
+parser.add_argument("--days", "-d", default=365, type=int,
+                    help="Number of days of hourly prices to replay")
+parser.add_argument("--ema", "-e", default=[26], type=int, nargs="+",
+                    help="Numbers of hours for EMA calculation")
+parser.add_argument("--threshold-ema", "-te", default=[2.5], type=float, nargs="+",
+                    help="Amounts current price needs to be above/below the EMA to cause a post to be sent")
+parser.add_argument("--threshold-reset", "-tr", default=[1.25], type=float, nargs="+",
+                    help="Amounts EMA price needs to be within last post price to reset")
+parser.add_argument("--candle-store", "-cs", default="candle_store", type=str,
+                    help="Directory candles are stored in, so that only new candles are requested from coinbase")
+parser.add_argument("--output", "-o", default=None, type=str,
+                    help="Json file to write the results of every combination to")
+parser.add_argument("--disable-stdout", "-dso", action="store_true",
+                    help="Disable log messages lower than ERROR from appearing in stdout")
+parser.add_argument("--disable-stderr", "-dse", action="store_true",
+                    help="Disable error messages from appearing in stdout (requires --disable-stdout to also be set)")
+args = parser.parse_args()
+
+LogSetup.setup(not args.disable_stdout, not args.disable_stderr, False, "")
+
+# Get hourly prices (newest first, the same as Coinbase.price_list)
+crypto, fiat = args.pair.split("-")
+cb = Coinbase(Currency(crypto, fiat), 60, CandleStore(args.candle_store))
+time_now = datetime.utcnow()
+candles = Candles.from_coinbase(cb.get_historical_prices(time_now - timedelta(days=args.days), time_now))
+prices = candles.open
+times = candles.time
+logging.info(f"Replaying {len(prices)} hours of {args.pair} prices")
+
+# The analysis logs every decision, which is too much (and too slow) for thousands of runs
+logging.getLogger().setLevel(logging.WARNING)
+results = Backtest(prices, times).sweep(args.ema, args.threshold_ema, args.threshold_reset)
+logging.getLogger().setLevel(logging.DEBUG)
+
+total_seconds = sum(result['seconds'] for result in results)
+logging.info(f"Replayed {len(results)} combinations in {total_seconds:.3f}s ({1000 * total_seconds / len(results):.2f}ms per combination)")
+for result in sorted(results, key=lambda r: (r['posts'], r['ema'], r['threshold_ema'], r['threshold_reset'])):
+    logging.info(f"EMA {result['ema']:>3}, threshold {result['threshold_ema']:>5.2f}%, reset {result['threshold_reset']:>5.2f}%: "
+                 f"{result['posts']} posts")
+
+if args.output is not None:
+    with open(args.output, "w") as f:
+        json.dump({'pair': args.pair, 'hours': len(prices), 'seconds': total_seconds, 'results': results}, f, indent=4)
+    logging.info(f"Results written to {args.output}")
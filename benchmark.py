@@ -0,0 +1,87 @@
+import logging
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+
+from src.benchmark import Benchmark
+from src.coinbase import Coinbase
+from src.fake_servers import FakeCoinbase, FakeSlack
+from src.logsetup import LogSetup
+from src.rate_limit import RateLimiter
+
+# Argparse
+parser = argparse.ArgumentParser(description="Time the webhook and slash command against local fake coinbase and slack servers")
+parser.add_argument("--benchmark", "-b", default=None, nargs="+", choices=list(Benchmark.BENCHMARKS),
+                    help="Benchmarks to run (all by default)")
+parser.add_argument("--iterations", "-n", default=10, type=int,
+                    help="Number of times to run each benchmark")
+parser.add_argument("--coinbase-latency", default=0.0, type=float,
+                    help="Seconds the fake coinbase server waits before responding")
+parser.add_argument("--coinbase-429-rate", default=0.0, type=float,
+                    help="Fraction of requests the fake coinbase server rate limits")
+parser.add_argument("--slack-latency", default=0.0, type=float,
+                    help="Seconds the fake slack server waits before responding")
+parser.add_argument("--slack-429-rate", default=0.0, type=float,
+                    help="Fraction of posts the fake slack server rate limits")
+parser.add_argument("--rate-limit", default=1000.0, type=float,
+                    help="Requests per second allowed to the fake coinbase server (8 is used for the real one)")
+parser.add_argument("--label", "-l", default=None, type=str,
+                    help="Label to add to the results (eg. the branch being tested)")
+parser.add_argument("--output", "-o", default=None, type=str,
+                    help="Json file to write the results to (they're compared between commits)")
+parser.add_argument("--disable-stdout", "-dso", action="store_true",
+                    help="Disable log messages lower than ERROR from appearing in stdout")
+parser.add_argument("--disable-stderr", "-dse", action="store_true",
+                    help="Disable error messages from appearing in stdout (requires --disable-stdout to also be set)")
+args = parser.parse_args()
+
+LogSetup.setup(not args.disable_stdout, not args.disable_stderr, False, "")
+
+# Point everything at the fake servers, every call should make its requests so the cache is disabled
+fake_coinbase = FakeCoinbase(args.coinbase_latency, args.coinbase_429_rate).start()
+fake_slack = FakeSlack(args.slack_latency, args.slack_429_rate).start()
+Coinbase.API_URL = fake_coinbase.url
+Coinbase.CACHE = None
+Coinbase.RATE_LIMITER = RateLimiter(rate=args.rate_limit, burst=max(1, int(args.rate_limit)))
+
+# The code being timed logs every step, which would be timed too
+logging.getLogger().setLevel(logging.WARNING)
+results = Benchmark(fake_coinbase, fake_slack, args.iterations).run(args.benchmark)
+logging.getLogger().setLevel(logging.DEBUG)
+
+for result in results:
+    logging.info(f"{result['name']:<25} median {result['median_ms']:>9.3f}ms, min {result['min_ms']:>9.3f}ms, max {result['max_ms']:>9.3f}ms "
+                 f"({result['coinbase_requests'] / result['iterations']:.1f} coinbase requests and {result['slack_posts'] / result['iterations']:.1f} slack posts per iteration)")
+
+if args.output is not None:
+    # noinspection PyBroadException
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        commit = None
+
+    output = {
+        'label': args.label,
+        'commit': commit,
+        'time': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'python': platform.python_version(),
+        'settings': {
+            'iterations': args.iterations,
+            'coinbase_latency': args.coinbase_latency,
+            'coinbase_429_rate': args.coinbase_429_rate,
+            'slack_latency': args.slack_latency,
+            'slack_429_rate': args.slack_429_rate,
+            'rate_limit': args.rate_limit
+        },
+        'results': results
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=4)
+    logging.info(f"Results written to {args.output}")
+
+fake_coinbase.stop()
+fake_slack.stop()
@@ -1,7 +1,15 @@
+import logging
 import argparse
 
+from src.admission import InFlightLimit, TokenBuckets
 from src.logsetup import LogSetup
 from src.server import CommandHandler
+from src.server_processor import ServerProcessor
+from src.http_client import HttpClient
+from src.coinbase import Coinbase
+from src.cache import TTLCache
+from src.rate_limit import RateLimiter
+from src.product_catalog import ProductCatalog
 
 # Constants
 LOG_LOC = "log_slash_command_server"
@@ -18,13 +26,77 @@ parser.add_argument("--disable-stdout", "-dso", action="store_true",
                     help="Disable log messages lower than ERROR from appearing in stdout")
 parser.add_argument("--disable-stderr", "-dse", action="store_true",
                     help="Disable error messages from appearing in stdout (requires --disable-stdout to also be set)")
+parser.add_argument("--log-level", "-ll", default="DEBUG", type=str, choices=["DEBUG", "INFO", "WARN", "ERROR"],
+                    help="Lowest level of log messages to output (messages below it are dropped before they're formatted)")
+parser.add_argument("--log-rotation", default="size", type=str, choices=LogSetup.ROTATIONS,
+                    help=f"Rotate log files when they reach {LogSetup.MAX_BYTES // (1024 * 1024)}MB ('size') or at midnight ('daily'), "
+                         f"keeping {LogSetup.BACKUP_COUNT} old files, or create a new file every run ('none')")
+parser.add_argument("--disable-log-queue", action="store_true",
+                    help="Format and write log messages in the thread logging them, instead of a separate logging thread")
 parser.add_argument("--max-days", "-md", type=int, default=10,
                     help="Maximum number of days allowed to retrieve")
+parser.add_argument("--server-threads", type=int, default=8,
+                    help="Number of threads handling incoming connections")
+parser.add_argument("--server-queue-size", type=int, default=32,
+                    help="Number of connections allowed to wait for a thread before new ones are rejected")
+parser.add_argument("--workers", type=int, default=4,
+                    help="Number of threads retrieving prices and posting responses for commands")
+parser.add_argument("--worker-queue-size", type=int, default=16,
+                    help="Number of commands allowed to wait for a worker before users are told to try again")
+parser.add_argument("--user-rate-limit", type=float, default=10,
+                    help="Commands each user can make per minute (0 doesn't limit them)")
+parser.add_argument("--user-burst", type=int, default=3,
+                    help="Commands each user can make at once before --user-rate-limit applies")
+parser.add_argument("--channel-rate-limit", type=float, default=30,
+                    help="Commands that can be made in each channel per minute (0 doesn't limit them)")
+parser.add_argument("--channel-burst", type=int, default=10,
+                    help="Commands that can be made in a channel at once before --channel-rate-limit applies")
+parser.add_argument("--max-in-flight", type=int, default=8,
+                    help="Maximum number of commands being processed at once, users are told to try again if there are more (0 doesn't limit them)")
+parser.add_argument("--response-deadline", type=float, default=ServerProcessor.RESPONSE_DEADLINE,
+                    help="Seconds after a command is received that the prices retrieved so far are posted (the rest are marked as unavailable)")
+parser.add_argument("--disable-progressive", action="store_true",
+                    help="Wait for every price before posting, instead of posting the current prices first and updating the message as the rest arrive")
+parser.add_argument("--cache-ttl", type=float, default=60,
+                    help="Seconds to cache coinbase responses for (requests in the same minute share data)")
+parser.add_argument("--cache-size", type=int, default=256,
+                    help="Maximum number of coinbase responses to cache (0 disables the cache)")
+parser.add_argument("--rate-limit-file", "-rlf", default=None, type=str,
+                    help="File used to share the coinbase rate limit with other processes using the same file (eg. other webhooks and the slash command)")
+parser.add_argument("--product-file", default="products.json", type=str,
+                    help="File to cache the list of currency pairs traded on coinbase in")
+parser.add_argument("--product-refresh", type=float, default=24,
+                    help="Hours before the list of currency pairs traded on coinbase is retrieved again")
+parser.add_argument("--disable-product-check", action="store_true",
+                    help="Don't check that coinbase trades a currency pair before requesting its prices")
+parser.add_argument("--http-pool-size", type=int, default=HttpClient.POOL_SIZE,
+                    help="Number of keep-alive connections to pool per host (coinbase and slack)")
+parser.add_argument("--http-connect-timeout", type=float, default=HttpClient.CONNECT_TIMEOUT,
+                    help="Seconds to wait when connecting to coinbase or slack")
+parser.add_argument("--http-read-timeout", type=float, default=HttpClient.READ_TIMEOUT,
+                    help="Seconds to wait for a response from coinbase or slack")
+parser.add_argument("--http-retries", type=int, default=HttpClient.RETRIES,
+                    help="Number of times to retry a request after a connection error or server error")
 args = parser.parse_args()
 
 # Setup and run
-LogSetup.setup(not args.disable_stdout, not args.disable_stderr, args.log_file, LOG_LOC)
+LogSetup.setup(not args.disable_stdout, not args.disable_stderr, args.log_file, LOG_LOC,
+               getattr(logging, args.log_level), not args.disable_log_queue, args.log_rotation)
 
+HttpClient.configure(args.http_pool_size, args.http_connect_timeout, args.http_read_timeout, args.http_retries)
+Coinbase.RATE_LIMITER = RateLimiter(state_file=args.rate_limit_file)
+Coinbase.CACHE = TTLCache(args.cache_ttl, args.cache_size) if args.cache_size > 0 else None
 CommandHandler.SIGNING_SECRET = getattr(args, "signing secret")
 CommandHandler.MAX_DAYS = args.max_days
-CommandHandler.run(args.port)
+ServerProcessor.PROGRESSIVE = not args.disable_progressive
+ServerProcessor.RESPONSE_DEADLINE = args.response_deadline
+if args.user_rate_limit > 0:
+    CommandHandler.USER_BUCKETS = TokenBuckets(args.user_rate_limit / 60, args.user_burst)
+if args.channel_rate_limit > 0:
+    CommandHandler.CHANNEL_BUCKETS = TokenBuckets(args.channel_rate_limit / 60, args.channel_burst)
+if args.max_in_flight > 0:
+    CommandHandler.IN_FLIGHT = InFlightLimit(args.max_in_flight)
+if not args.disable_product_check:
+    CommandHandler.PRODUCT_CATALOG = ProductCatalog(args.product_file, args.product_refresh * 3600)
+    CommandHandler.PRODUCT_CATALOG.get_pairs()
+CommandHandler.run(args.port, args.server_threads, args.server_queue_size, args.workers, args.worker_queue_size)
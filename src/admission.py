@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+"""Signatures of requests that have already been accepted, so a captured request can't be replayed while its timestamp is still valid
+Entries are kept for the replay window, and the oldest are dropped if there are more than max_size. Thread safe"""
+class NonceCache:
+    def __init__(self, window: float = 300, max_size: int = 10000):
+        self.window = window
+        self.max_size = max_size
+
+        self.lock = threading.Lock()
+        self.seen = OrderedDict()
+
+    """Add a (timestamp, signature) pair, returns False if it has already been seen"""
+    def add(self, timestamp: int, signature: str):
+        now = time.time()
+        key = (timestamp, signature)
+        with self.lock:
+            # Entries are roughly in expiry order, as slack timestamps are close to the time they're received
+            while len(self.seen) > 0:
+                oldest_key, expires = next(iter(self.seen.items()))
+                if expires > now and len(self.seen) < self.max_size:
+                    break
+                del self.seen[oldest_key]
+
+            if key in self.seen:
+                return False
+
+            self.seen[key] = max(timestamp, now) + self.window
+            return True
+
+"""Token bucket per key (eg. user or channel), each allows bursts of up to burst commands and refills at rate per second
+Unlike RateLimiter, taking a token doesn't wait. Buckets that have refilled are dropped, so only recently active keys are kept. Thread safe"""
+class TokenBuckets:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.last_cleanup = time.time()
+
+    """Take a token from the key's bucket, returns False if it's empty"""
+    def take(self, key: str):
+        now = time.time()
+        with self.lock:
+            if now - self.last_cleanup > self.burst / self.rate:
+                self.cleanup(now)
+
+            tokens, updated = self.buckets.get(key, (float(self.burst), now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return False
+
+            self.buckets[key] = (tokens - 1, now)
+            return True
+
+    """Drop buckets that would be full by now (same as a new bucket). Must be called with the lock held"""
+    def cleanup(self, now: float):
+        self.buckets = {key: (tokens, updated) for key, (tokens, updated) in self.buckets.items()
+                        if tokens + (now - updated) * self.rate < self.burst}
+        self.last_cleanup = now
+
+"""Limit on the number of commands being processed at once, acquiring doesn't wait so that extra commands can be turned away straight away"""
+class InFlightLimit:
+    def __init__(self, limit: int):
+        self.limit = limit
+
+        self.lock = threading.Lock()
+        self.count = 0
+
+    """Returns False if the limit has been reached"""
+    def acquire(self):
+        with self.lock:
+            if self.count >= self.limit:
+                logging.warning(f"{self.count} commands are already being processed")
+                return False
+
+            self.count += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.count -= 1
@@ -58,6 +58,5 @@ class Analysis:
             if should_reset:
                 logging.info("Resetting EMA")
                 history.ema_reset = True
-                history.save()
 
         return True
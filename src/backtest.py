@@ -0,0 +1,152 @@
+import logging
+import time
+import itertools
+
+from src.analysis import Analysis
+from src.history import History
+from src import vector_stats
+from src.vector_stats import HourDataSeries
+
+"""Replays the alert rules (Analysis.ema_checks and Analysis.should_post) over historical hourly prices
+History is kept in memory, and with numpy every combination of thresholds for an EMA window is replayed in a single pass over the hours"""
+class Backtest:
+    def __init__(self, prices: list, times: list):
+        self.prices = prices
+        self.times = times
+        self.series = {}
+        self.arrays = {}
+
+    """Calculate the stats for every hour for each EMA window (only done once per window)"""
+    def prepare(self, ema_windows: list):
+        missing = [window for window in ema_windows if window not in self.series]
+        if len(missing) > 0:
+            self.series.update(HourDataSeries.for_windows(self.prices, missing))
+
+    """Replay the rules for one set of parameters, returning the times of each post"""
+    def run(self, ema_num_hours: int, threshold_ema: float, threshold_reset: float):
+        self.prepare([ema_num_hours])
+        if vector_stats.numpy is None:
+            return self.run_every_hour(self.series[ema_num_hours], threshold_ema, threshold_reset)
+
+        return self.run_many(ema_num_hours, [threshold_ema], [threshold_reset])[0]
+
+    """Replay the rules for many pairs of thresholds with the same EMA window at once, returning the times of each post for each pair
+    The history of every pair is kept in arrays and the hours are stepped through once, applying the same rules as
+    Analysis.ema_checks and Analysis.should_post to every pair (run_every_hour uses Analysis itself, and gives the same posts)"""
+    def run_many(self, ema_num_hours: int, thresholds_ema: list, thresholds_reset: list):
+        numpy = vector_stats.numpy
+        self.prepare([ema_num_hours])
+        series = self.series[ema_num_hours]
+
+        # Step i is the hour at offset num_steps - 1 - i (so steps are oldest first)
+        num_steps = len(series)
+        ema, cur_price, rising, hour_agrees = self.step_arrays(ema_num_hours)
+        percent_diff = series.ema_percent_diff_positive[::-1]
+
+        threshold_ema = numpy.asarray(thresholds_ema, dtype=float)
+        threshold_reset = numpy.asarray(thresholds_reset, dtype=float)
+        post_above, post_below = 1 + threshold_ema / 100, 1 - threshold_ema / 100
+        reset_below, reset_above = 1 - threshold_reset / 100, 1 + threshold_reset / 100
+
+        # History of each pair, with the prices that the current price must beat to post again and the EMA must pass to reset
+        # Multiplying by sign turns the comparisons for a falling last post around, so both directions use >
+        ema_reset = numpy.ones(len(threshold_ema), dtype=bool)
+        last_rising = numpy.ones(len(threshold_ema), dtype=bool)
+        sign = numpy.ones(len(threshold_ema))
+        post_price = numpy.zeros(len(threshold_ema))
+        reset_price = numpy.zeros(len(threshold_ema))
+
+        posted = numpy.zeros((num_steps, len(threshold_ema)), dtype=bool)
+        for step, (step_ema, step_price, step_rising, step_agrees, step_diff) in \
+                enumerate(zip(ema.tolist(), cur_price.tolist(), rising.tolist(), hour_agrees.tolist(), percent_diff.tolist())):
+            outside = threshold_ema < step_diff
+
+            # Analysis.ema_checks, the EMA is reset if it has gone back within the reset threshold of the last post
+            if not outside.all():
+                ema_reset |= ~outside & ((step_ema - reset_price) * sign > 0)
+
+            # Analysis.should_post
+            if not outside.any():
+                continue
+            if step_agrees:
+                post = ema_reset | ((step_price - post_price) * sign > 0)
+                post |= last_rising != step_rising
+            else:
+                post = last_rising != step_rising
+            post &= outside
+            if not post.any():
+                continue
+
+            posted[step] = post
+            ema_reset[post] = False
+            last_rising[post] = step_rising
+            sign[post] = 1 if step_rising else -1
+            post_price[post] = step_price * (post_above[post] if step_rising else post_below[post])
+            reset_price[post] = step_price * (reset_below[post] if step_rising else reset_above[post])
+
+        return [[self.times[num_steps - 1 - step] for step in numpy.flatnonzero(posted[:, i]).tolist()] for i in range(len(threshold_ema))]
+
+    """Arrays (oldest first) of the EMA, price, EMA direction and whether the hourly change agrees with it
+    These only depend on the EMA window so are cached between runs"""
+    def step_arrays(self, ema_num_hours: int):
+        if ema_num_hours not in self.arrays:
+            series = self.series[ema_num_hours]
+            prices = vector_stats.numpy.asarray(self.prices[:len(series) + 1], dtype=float)[::-1]
+            rising = series.is_diff_positive[::-1]
+            self.arrays[ema_num_hours] = (series.ema[::-1], prices[1:], rising, (prices[1:] > prices[:-1]) == rising)
+
+        return self.arrays[ema_num_hours]
+
+    """Replay the rules for every hour, used when numpy isn't installed"""
+    def run_every_hour(self, series: HourDataSeries, threshold_ema: float, threshold_reset: float):
+        history = History()
+        post_times = []
+        for step in range(len(series)):
+            if self.replay_step(series, step, history, threshold_ema, threshold_reset):
+                post_times.append(self.times[len(series) - 1 - step])
+
+        return post_times
+
+    """Run Analysis for a single hour, updating the history like webhook-notifier.py does if a message would be posted"""
+    def replay_step(self, series: HourDataSeries, step: int, history: History, threshold_ema: float, threshold_reset: float):
+        offset = len(series) - 1 - step
+        stats = series.at(offset)
+        if Analysis.ema_checks(stats, history, threshold_ema, threshold_reset):
+            return False
+        if not Analysis.should_post(history, stats, self.prices[offset:offset + 2], threshold_ema):
+            return False
+
+        history.price = stats.cur_price
+        history.rising = stats.is_diff_positive
+        history.ema_reset = False
+        return True
+
+    """Run every combination of the parameters given, returning a result dictionary for each
+    With numpy the combinations for each EMA window are run together, so each gets an equal share of the time taken"""
+    def sweep(self, ema_windows: list, thresholds_ema: list, thresholds_reset: list):
+        start = time.perf_counter()
+        self.prepare(ema_windows)
+        logging.info(f"Calculated stats for {len(ema_windows)} EMA windows in {time.perf_counter() - start:.3f}s")
+
+        results = []
+        thresholds = list(itertools.product(thresholds_ema, thresholds_reset))
+        for ema_num_hours in ema_windows:
+            run_start = time.perf_counter()
+            if vector_stats.numpy is None:
+                all_post_times = [self.run(ema_num_hours, threshold_ema, threshold_reset) for threshold_ema, threshold_reset in thresholds]
+            else:
+                all_post_times = self.run_many(ema_num_hours, [pair[0] for pair in thresholds], [pair[1] for pair in thresholds])
+            seconds = (time.perf_counter() - run_start) / max(len(thresholds), 1)
+
+            for (threshold_ema, threshold_reset), post_times in zip(thresholds, all_post_times):
+                results.append({
+                    'ema': ema_num_hours,
+                    'threshold_ema': threshold_ema,
+                    'threshold_reset': threshold_reset,
+                    'posts': len(post_times),
+                    'post_times': post_times,
+                    'seconds': seconds
+                })
+
+        logging.info(f"Ran {len(results)} combinations over {len(self.prices)} hours in {time.perf_counter() - start:.3f}s")
+        return results
@@ -0,0 +1,245 @@
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from src.analysis import Analysis
+from src.coinbase import Coinbase, Currencies, Currency
+from src.fake_servers import FakeCoinbase, FakeSlack, FakeTickerFeed
+from src.history import History
+from src.notifier import AlertConfig
+from src.server_processor import ServerProcessor
+from src.slack import Slack
+from src.stats import HourData, Stats
+from src.streaming import TickerStream
+from src.vector_stats import HourDataSeries
+
+"""Times the main steps of the webhook and slash command against the local fake coinbase and slack servers
+Results are in milliseconds per call"""
+class Benchmark:
+    ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    NOTIFIER_SCRIPT = os.path.join(ROOT, "webhook-notifier.py")
+
+    # Modules imported by webhook-notifier.py before it does anything, and the time allowed to import them in a new process
+    # Slow modules (eg. requests) should only be imported when they're used, so most cron runs never import them
+    NOTIFIER_MODULES = ["src.coinbase", "src.candle_store", "src.logsetup", "src.metrics", "src.notifier", "src.outbox", "src.rate_limit",
+                        "src.state_store"]
+    LAZY_MODULES = ["requests", "urllib3", "ssl", "numpy"]
+    IMPORT_BUDGET_MS = 50
+
+    # Name -> method, in the order they're run
+    BENCHMARKS = {
+        "price_list": "bench_price_list",
+        "hour_data": "bench_hour_data",
+        "hour_data_series": "bench_hour_data_series",
+        "analysis": "bench_analysis",
+        "generate_post": "bench_generate_post",
+        "create_slack_attachments": "bench_create_slack_attachments",
+        "notifier_import": "bench_notifier_import",
+        "notifier_run": "bench_notifier_run",
+        "ticker_stream": "bench_ticker_stream"
+    }
+
+    # Calls per timed iteration for benchmarks that don't make requests, so that the timer's resolution doesn't matter
+    COMPUTE_REPEATS = 100
+
+    # Largest relative difference allowed between HourDataSeries and Stats.ema_and_sma
+    SERIES_TOLERANCE = 1e-9
+
+    # Ticks sent by the fake ticker feed on each connection, and the number of connections (so the stream reconnects once less)
+    # The ticks start half way through the current hour and run past the end of it, so the stream rolls over to a new hour
+    TICKS_PER_CONNECTION = 60
+    TICK_CONNECTIONS = 3
+    TICK_INTERVAL = 30
+    STREAM_TIMEOUT = 30
+
+    def __init__(self, coinbase: FakeCoinbase, slack: FakeSlack, iterations: int = 10, ema: int = 26):
+        self.coinbase = coinbase
+        self.slack = slack
+        self.iterations = iterations
+        self.ema = ema
+
+        self.currency = Currencies.default()
+        self.prices = None
+
+    """Run the benchmarks given (every benchmark by default), returning a list of results"""
+    def run(self, names: list = None):
+        if names is None:
+            names = list(self.BENCHMARKS)
+
+        results = []
+        for name in names:
+            logging.warning(f"Running benchmark {name}")
+            results.append(getattr(self, self.BENCHMARKS[name])())
+
+        return results
+
+    """Time iterations calls of func (each calling it repeats times), setup is called before each iteration but isn't timed"""
+    def time(self, name: str, func, repeats: int = 1, setup=None):
+        requests_before = self.coinbase.requests
+        posts_before = self.slack.requests
+        times = []
+        for _ in range(self.iterations):
+            args = () if setup is None else (setup(),)
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                func(*args)
+            times.append((time.perf_counter() - start) * 1000 / repeats)
+
+        return self.summarise(name, times, repeats, requests_before, posts_before)
+
+    def summarise(self, name: str, times: list, repeats: int, requests_before: int, posts_before: int):
+        return {
+            'name': name,
+            'iterations': self.iterations,
+            'repeats': repeats,
+            'min_ms': min(times),
+            'mean_ms': statistics.mean(times),
+            'median_ms': statistics.median(times),
+            'max_ms': max(times),
+            'stdev_ms': statistics.stdev(times) if len(times) > 1 else 0.0,
+            'coinbase_requests': self.coinbase.requests - requests_before,
+            'slack_posts': self.slack.requests - posts_before
+        }
+
+    """Hourly prices for the default pair, retrieved once and shared by the benchmarks that don't make requests"""
+    def get_prices(self):
+        if self.prices is None:
+            self.prices = Coinbase(self.currency, 60).price_list()
+        return self.prices
+
+    def bench_price_list(self):
+        return self.time("price_list", lambda: Coinbase(self.currency, 60).price_list())
+
+    def bench_hour_data(self):
+        prices = self.get_prices()
+        return self.time("hour_data", lambda: HourData(prices, self.ema), self.COMPUTE_REPEATS)
+
+    """HourDataSeries for every offset of the prices, checked against Stats.ema_and_sma at each offset"""
+    def bench_hour_data_series(self):
+        prices = self.get_prices()
+        result = self.time("hour_data_series", lambda: HourDataSeries(prices, self.ema), self.COMPUTE_REPEATS)
+
+        series = HourDataSeries(prices, self.ema)
+        expected = [Stats.ema_and_sma(prices[offset:][::-1], self.ema) for offset in range(len(series))]
+        result['max_ema_error'] = max(abs(series.ema[offset] - ema) / ema for offset, (ema, _) in enumerate(expected))
+        result['max_sma_error'] = max(abs(series.sma[offset] - sma) / sma for offset, (_, sma) in enumerate(expected))
+
+        if max(result['max_ema_error'], result['max_sma_error']) > self.SERIES_TOLERANCE:
+            logging.warning(f"HourDataSeries differs from Stats.ema_and_sma (EMA by {result['max_ema_error']:.2e}, "
+                            f"SMA by {result['max_sma_error']:.2e})")
+
+        return result
+
+    def bench_analysis(self):
+        prices = self.get_prices()
+        stats = HourData(prices, self.ema)
+
+        def analyse(history: History):
+            if not Analysis.ema_checks(stats, history, 0.0, 1.25):
+                Analysis.should_post(history, stats, prices, 0.0)
+
+        return self.time("analysis", analyse, self.COMPUTE_REPEATS, setup=History)
+
+    def bench_generate_post(self):
+        prices = self.get_prices()
+        stats = HourData(prices, self.ema)
+        return self.time("generate_post", lambda: Slack.generate_post(prices, stats, self.currency))
+
+    def bench_create_slack_attachments(self):
+        currency = Currency("ETH", "USD")
+        return self.time("create_slack_attachments", lambda: ServerProcessor.create_slack_attachments(currency, [2, 7, 14, 28]))
+
+    """Time to import the notifier's modules in a new process, checked against the import budget
+    Also checks that none of the slow modules that should be imported lazily are imported"""
+    def bench_notifier_import(self):
+        code = "import sys, time\n" \
+               "start = time.perf_counter()\n" \
+               f"import {', '.join(self.NOTIFIER_MODULES)}\n" \
+               "print(time.perf_counter() - start)\n" \
+               f"print(','.join(module for module in {self.LAZY_MODULES!r} if module in sys.modules))"
+
+        times = []
+        loaded = set()
+        for _ in range(self.iterations):
+            output = subprocess.run([sys.executable, "-c", code], cwd=self.ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    universal_newlines=True, check=True).stdout.split("\n")
+            times.append(float(output[0]) * 1000)
+            loaded.update(module for module in output[1].split(",") if module != "")
+
+        result = self.summarise("notifier_import", times, 1, self.coinbase.requests, self.slack.requests)
+        result['budget_ms'] = self.IMPORT_BUDGET_MS
+        result['over_budget'] = result['median_ms'] > self.IMPORT_BUDGET_MS
+        result['lazy_modules_imported'] = sorted(loaded)
+
+        if result['over_budget']:
+            logging.warning(f"Importing the notifier's modules took {result['median_ms']:.1f}ms, the budget is {self.IMPORT_BUDGET_MS}ms")
+        if len(loaded) > 0:
+            logging.warning(f"Modules that should only be imported when used were imported at start up: {', '.join(sorted(loaded))}")
+
+        return result
+
+    """A full run of webhook-notifier.py in a new process (including startup), with a threshold of 0 so that it posts"""
+    def bench_notifier_run(self):
+        def notifier_run(directory: str):
+            subprocess.run([sys.executable, self.NOTIFIER_SCRIPT, f"{self.slack.url}/webhook",
+                            "--api-url", self.coinbase.url, "--threshold-ema", "0", "--disable-candle-store",
+                            "--disable-stdout", "--disable-stderr"],
+                           cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+
+        with tempfile.TemporaryDirectory() as root:
+            def new_directory():
+                return tempfile.mkdtemp(dir=root)
+
+            return self.time("notifier_run", notifier_run, setup=new_directory)
+
+    """TickerStream against the fake ticker feed, from bootstrapping until it has checked the last tick
+    The feed closes each connection after its ticks, so this covers reconnecting and the ticks cross into the next hour
+    Checks that the stream reconnected to every connection and rolled over to the last tick's hour"""
+    def bench_ticker_stream(self):
+        hour_start = time.time() // TickerStream.SECS_IN_HOUR * TickerStream.SECS_IN_HOUR
+        config = AlertConfig(f"{self.slack.url}/webhook", self.currency, ema=self.ema, script_name="benchmark")
+        feeds = []
+        checks = []
+
+        # Feeds are stopped after the timing, as shutting down a server waits for its polling interval
+        def new_feed():
+            feeds.append(FakeTickerFeed(hour_start + TickerStream.SECS_IN_HOUR / 2, self.TICKS_PER_CONNECTION, self.TICK_CONNECTIONS,
+                                        self.TICK_INTERVAL, self.currency.pair).start())
+            return feeds[-1]
+
+        def ticker_stream(feed: FakeTickerFeed):
+            stream = TickerStream(config, Coinbase(self.currency, 60), feed.url, debounce=0, reconnect_delay=0.01, history=History())
+            thread = threading.Thread(target=stream.run_forever, name="TickerStream", daemon=True)
+            thread.start()
+
+            deadline = time.perf_counter() + self.STREAM_TIMEOUT
+            while stream.last_evaluated < feed.end_time - 1 and time.perf_counter() < deadline:
+                time.sleep(0.001)
+
+            # Once stopped, the stream exits when the feed refuses its next connection
+            stream.stop()
+            thread.join(self.STREAM_TIMEOUT)
+            checks.append((feed.connections, feed.ticks_sent, stream.times[0] if len(stream.times) > 0 else None,
+                           feed.end_time // TickerStream.SECS_IN_HOUR * TickerStream.SECS_IN_HOUR))
+
+        result = self.time("ticker_stream", ticker_stream, setup=new_feed)
+        for feed in feeds:
+            feed.stop()
+
+        connections, ticks_sent, stream_hour, last_tick_hour = checks[-1]
+        result['reconnects'] = connections - 1
+        result['ticks'] = ticks_sent
+        result['rolled_over'] = stream_hour == last_tick_hour
+
+        if connections < self.TICK_CONNECTIONS:
+            logging.warning(f"The ticker stream only connected {connections} of {self.TICK_CONNECTIONS} times")
+        if not result['rolled_over']:
+            logging.warning("The ticker stream didn't roll over to the hour of the last tick")
+
+        return result
@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+"""Thread safe cache with a time to live and least recently used eviction
+Concurrent lookups of the same missing key are coalesced, so they share a single call to the loader"""
+class TTLCache:
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    """Return the cached value for the key, otherwise call loader() to get it
+    If another thread is already loading the key then wait for its result instead"""
+    def get_or_load(self, key, loader):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self.in_flight[key] = future
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            with self.lock:
+                self.entries[key] = (time.monotonic() + self.ttl, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+            return value
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'size': len(self.entries)
+            }
+
+    def log_stats(self, name: str):
+        stats = self.stats()
+        lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+        hit_rate = 0 if lookups == 0 else 100 * (stats['hits'] + stats['coalesced']) / lookups
+        logging.info(f"{name} cache: {stats['hits']} hits, {stats['coalesced']} coalesced, {stats['misses']} misses "
+                     f"({hit_rate:.0f}% hit rate, {stats['size']}/{self.max_size} entries)")
@@ -0,0 +1,275 @@
+import logging
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+
+"""Persistent store of raw coinbase candles, with one json file per (pair, granularity)
+Keeps track of which time ranges have been fully retrieved, so that only the missing ranges need to be requested
+and which ranges have been backfilled (requested again because candles were missing), so gaps that coinbase has no candles for are only requested again once
+Candle times are also kept sorted, so that ranges can be found with a binary search
+If a max age (seconds) is given then candles retrieved less than that long ago are treated as up to date, so no request is needed
+Coarse candles (15 minute, hourly and daily) can be rolled up from stored finer candles instead of being requested
+If a retention policy is given (granularity -> days) then older candles are rolled up into the next coarser granularity and removed when saving
+Safe to share between threads"""
+class CandleStore:
+    # Granularities that can be built from finer granularities (coarsest first)
+    ROLLUPS = {
+        900: (300, 60),
+        3600: (900, 300, 60),
+        86400: (3600, 900, 300, 60)
+    }
+
+    # Days of candles kept for each granularity, fine candles are only needed for recent prices (granularities not listed are kept forever)
+    # Each window must cover the longest window read at that granularity, otherwise candles are removed and requested again every run:
+    # the notifier reads 300 hours (12.5 days) at its interval (5, 15 or 60 minutes), and posts read the price 28 days ago
+    RETENTION = {
+        60: 2,
+        300: 14,
+        900: 35,
+        3600: 730
+    }
+
+    def __init__(self, location: str = "candle_store", max_age: float = 0, retention: dict = None):
+        self.location = location
+        self.max_age = max_age
+        self.retention = retention
+        self.series = {}
+        self.lock = threading.RLock()
+
+    def file_name(self, pair: str, granularity: int):
+        return f"{self.location}/{pair}_{granularity}.json"
+
+    """Return the in memory series for a key, loading it from disk the first time"""
+    def load(self, pair: str, granularity: int):
+        with self.lock:
+            key = (pair, granularity)
+            if key in self.series:
+                return self.series[key]
+
+            file_name = self.file_name(pair, granularity)
+            try:
+                with open(file_name, "r") as f:
+                    data = json.loads(f.read())
+                    series = {
+                        'candles': {entry[0]: entry for entry in data['candles']},
+                        'spans': data['spans'],
+                        'backfilled': data.get('backfilled', []),
+                        'updated': data.get('updated', 0)
+                    }
+                    series['times'] = sorted(series['candles'])
+                logging.debug(f"Loaded {len(series['candles'])} candles from {file_name}")
+            except (IOError, ValueError, KeyError):
+                logging.info(f"Couldn't load candle store {file_name}, starting with an empty store")
+                series = {'candles': {}, 'spans': [], 'backfilled': [], 'times': [], 'updated': 0}
+
+            self.series[key] = series
+            return series
+
+    def save(self, pair: str, granularity: int):
+        with self.lock:
+            series = self.load(pair, granularity)
+            self.apply_retention(pair, granularity, int(time.time()))
+            if not os.path.isdir(self.location):
+                os.makedirs(self.location, exist_ok=True)
+
+            new_data = {
+                'updated': series['updated'],
+                'spans': series['spans'],
+                'backfilled': series['backfilled'],
+                'candles': [series['candles'][t] for t in series['times']]
+            }
+
+            # Write to a temporary file first so an interrupted run can't corrupt the store
+            # Each save uses its own temporary file, as processes started at the same time (eg. by cron) may save the same series
+            file_name = self.file_name(pair, granularity)
+            fd, temp_name = tempfile.mkstemp(dir=self.location, prefix=os.path.basename(file_name) + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(new_data, f)
+                os.replace(temp_name, file_name)
+            except BaseException:
+                os.remove(temp_name)
+                raise
+
+    """Candle start times (inclusive) that haven't been retrieved for the range given
+    Times are unix timestamps, and candles are included if they start within the range given (the same as coinbase)"""
+    def missing_ranges(self, pair: str, granularity: int, start: int, end: int):
+        with self.lock:
+            start += -start % granularity
+            end -= end % granularity
+
+            missing = []
+            for span_start, span_end in self.load(pair, granularity)['spans']:
+                if span_end < start:
+                    continue
+                if span_start > end:
+                    break
+
+                if span_start > start:
+                    missing.append((start, span_start - granularity))
+                start = span_end + granularity
+
+            if start <= end:
+                missing.append((start, end))
+
+            return missing
+
+    """If candles were retrieved within the max age, then the time (unix timestamp) they were retrieved, otherwise None"""
+    def fresh_since(self, pair: str, granularity: int, time_now: int):
+        with self.lock:
+            updated = self.load(pair, granularity)['updated']
+            if self.max_age > 0 and time_now - updated <= self.max_age:
+                return updated
+            return None
+
+    """Add candles retrieved for the range given
+    The range is only marked as retrieved up to the last candle that had closed at the time of the request"""
+    def add(self, pair: str, granularity: int, candles: list, start: int, end: int, request_time: int):
+        with self.lock:
+            series = self.load(pair, granularity)
+            series['updated'] = max(series['updated'], request_time)
+            self.insert(series, candles)
+
+            end = min(end, request_time - request_time % granularity - granularity)
+            if end < start:
+                return
+
+            self.merge_span(series, granularity, start, end)
+
+    """Record that the range given was backfilled, up to the last candle that had closed at the time of the request"""
+    def add_backfilled(self, pair: str, granularity: int, start: int, end: int, request_time: int):
+        with self.lock:
+            end = min(end, request_time - request_time % granularity - granularity)
+            if end < start:
+                return
+
+            self.merge_span(self.load(pair, granularity), granularity, start, end, 'backfilled')
+
+    """Candle start times (of those given) that haven't been backfilled"""
+    def not_backfilled(self, pair: str, granularity: int, times: list):
+        with self.lock:
+            spans = self.load(pair, granularity)['backfilled']
+            return [t for t in times if not any(span_start <= t <= span_end for span_start, span_end in spans)]
+
+    """Add candles to a series. Must be called with the lock held"""
+    @staticmethod
+    def insert(series: dict, candles: list):
+        for entry in candles:
+            if entry[0] not in series['candles']:
+                bisect.insort(series['times'], entry[0])
+            series['candles'][entry[0]] = entry
+
+    """Merge a retrieved (or backfilled) span into the existing (sorted and non overlapping) spans of a series. Must be called with the lock held"""
+    @staticmethod
+    def merge_span(series: dict, granularity: int, start: int, end: int, key: str = 'spans'):
+        spans = sorted(series[key] + [[start, end]])
+        merged = [spans[0]]
+        for span_start, span_end in spans[1:]:
+            if span_start <= merged[-1][1] + granularity:
+                merged[-1][1] = max(merged[-1][1], span_end)
+            else:
+                merged.append([span_start, span_end])
+        series[key] = merged
+
+    """Build the candles of a coarse granularity that are missing in the range given from stored finer candles
+    Only candles whose whole period is covered by the finer candles are built, returns the number of candles built"""
+    def rollup(self, pair: str, granularity: int, start: int, end: int):
+        sources = self.ROLLUPS.get(granularity)
+        if sources is None:
+            return 0
+
+        with self.lock:
+            built = 0
+            for source in sources:
+                # Don't create (and log about) series that have never been stored
+                if (pair, source) not in self.series and not os.path.exists(self.file_name(pair, source)):
+                    continue
+
+                for range_start, range_end in self.missing_ranges(pair, granularity, start, end):
+                    built += self.rollup_range(pair, granularity, source, range_start, range_end)
+
+            if built > 0:
+                logging.info(f"Built {built} {pair} {granularity}s candles from stored finer candles")
+            return built
+
+    """Build the candles of a granularity from the candles of a finer granularity for the range given (aligned to the granularity)
+    Must be called with the lock held"""
+    def rollup_range(self, pair: str, granularity: int, source: int, start: int, end: int):
+        source_series = self.load(pair, source)
+        series = self.load(pair, granularity)
+
+        built = 0
+        for span_start, span_end in source_series['spans']:
+            # Candles whose first and last finer candles are both in the span
+            first = max(start, span_start + -span_start % granularity)
+            last = span_end + source - granularity
+            last = min(end, last - last % granularity)
+            if first > last:
+                continue
+
+            candles = []
+            times = source_series['times']
+            for candle_start in range(first, last + 1, granularity):
+                index = bisect.bisect_left(times, candle_start)
+                entries = []
+                while index < len(times) and times[index] < candle_start + granularity:
+                    entries.append(source_series['candles'][times[index]])
+                    index += 1
+
+                # Coinbase doesn't return candles for periods with no trades
+                if len(entries) == 0:
+                    continue
+
+                # [time, low, high, open, close, volume]
+                candles.append([candle_start, min(entry[1] for entry in entries), max(entry[2] for entry in entries),
+                                entries[0][3], entries[-1][4], sum(entry[5] for entry in entries)])
+
+            self.insert(series, candles)
+            self.merge_span(series, granularity, first, last)
+            built += len(candles)
+
+        return built
+
+    """Remove candles older than the retention policy allows, after rolling them up into the next coarser granularity
+    Must be called with the lock held"""
+    def apply_retention(self, pair: str, granularity: int, time_now: int):
+        days = None if self.retention is None else self.retention.get(granularity)
+        series = self.load(pair, granularity)
+        if days is None or len(series['spans']) == 0:
+            return
+
+        cutoff = int(time_now - days * 86400)
+        cutoff -= cutoff % granularity
+        if series['spans'][0][0] >= cutoff:
+            return
+
+        # Keep the history in the next coarser granularity
+        targets = [target for target, sources in self.ROLLUPS.items() if granularity in sources]
+        if len(targets) > 0:
+            target = min(targets)
+            built = 0
+            for range_start, range_end in self.missing_ranges(pair, target, series['spans'][0][0], cutoff - 1):
+                built += self.rollup_range(pair, target, granularity, range_start, range_end)
+            if built > 0:
+                self.save(pair, target)
+
+        times = series['times']
+        index = bisect.bisect_left(times, cutoff)
+        for t in times[:index]:
+            del series['candles'][t]
+        del times[:index]
+        series['spans'] = [[max(span_start, cutoff), span_end] for span_start, span_end in series['spans'] if span_end >= cutoff]
+        series['backfilled'] = [[max(span_start, cutoff), span_end] for span_start, span_end in series['backfilled'] if span_end >= cutoff]
+        logging.info(f"Removed {index} {pair} {granularity}s candles older than {days} days from the candle store")
+
+    """Get stored candles between the times given (inclusive), newest first as coinbase returns them"""
+    def get(self, pair: str, granularity: int, start: int, end: int):
+        with self.lock:
+            series = self.load(pair, granularity)
+            times = series['times']
+            first = bisect.bisect_left(times, start)
+            last = bisect.bisect_right(times, end)
+            return [series['candles'][times[i]] for i in range(last - 1, first - 1, -1)]
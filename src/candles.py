@@ -0,0 +1,68 @@
+from array import array
+
+"""Candles stored as one array per field, instead of a dict or list per candle
+Kept newest first, the same order that coinbase returns them in"""
+class Candles:
+    FIELDS = ("time", "low", "high", "open", "close", "volume")
+
+    def __init__(self, time=(), low=(), high=(), open_=(), close=(), volume=()):
+        self.time = array("q", time)
+        self.low = array("d", low)
+        self.high = array("d", high)
+        self.open = array("d", open_)
+        self.close = array("d", close)
+        self.volume = array("d", volume)
+
+    """Create from coinbase's response format ([time, low, high, open, close, volume] per candle)"""
+    @classmethod
+    def from_coinbase(cls, entries: list):
+        candles = cls()
+        for entry in entries:
+            candles.append(*entry)
+        return candles
+
+    def append(self, time: int, low: float, high: float, open_: float, close: float, volume: float):
+        self.time.append(int(time))
+        self.low.append(low)
+        self.high.append(high)
+        self.open.append(open_)
+        self.close.append(close)
+        self.volume.append(volume)
+
+    """Index of the newest candle that starts at or before the unix timestamp given, or None if every candle is later
+    Binary search over the (newest first) times, starting from index lo"""
+    def index_at_or_before(self, timestamp: int, lo: int = 0):
+        hi = len(self.time)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.time[mid] <= timestamp:
+                hi = mid
+            else:
+                lo = mid + 1
+
+        return lo if lo < len(self.time) else None
+
+    """index_at_or_before for many timestamps (in any order)
+    Timestamps are resolved latest first, so each search only covers the candles left from the previous one"""
+    def indexes_at_or_before(self, timestamps: list):
+        indexes = [None] * len(timestamps)
+        lo = 0
+        for i in sorted(range(len(timestamps)), key=lambda i: timestamps[i], reverse=True):
+            index = self.index_at_or_before(timestamps[i], lo)
+            if index is None:
+                break
+
+            indexes[i] = index
+            lo = index
+
+        return indexes
+
+    def __len__(self):
+        return len(self.time)
+
+    """Indexing with a slice gives a new Candles, indexing with an int gives a (time, low, high, open, close, volume) tuple"""
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Candles(self.time[index], self.low[index], self.high[index], self.open[index], self.close[index], self.volume[index])
+
+        return self.time[index], self.low[index], self.high[index], self.open[index], self.close[index], self.volume[index]
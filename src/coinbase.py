@@ -1,9 +1,16 @@
 import logging
-import time
+import calendar
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
 from datetime import datetime, timedelta
 import json
 
-import requests
+from src.cache import TTLCache
+from src.candle_store import CandleStore
+from src.candles import Candles
+from src.http_client import HttpClient
+from src.metrics import Metrics
+from src.rate_limit import RateLimiter
 
 class Currencies:
     CRYPTO_DEFAULT = "BTC"
@@ -29,25 +36,18 @@ class Currencies:
         "USD": "$"
     }
 
+    # Case folded codes and aliases -> code, so matching a string is a single lookup
+    CRYPTO_INDEX = {alias.casefold(): code for code, aliases in CRYPTO_MAP.items() for alias in [code] + aliases}
+    FIAT_INDEX = {alias.casefold(): code for code, aliases in FIAT_MAP.items() for alias in [code] + aliases}
+
     @classmethod
     def default(cls):
         return Currency(cls.CRYPTO_DEFAULT, cls.FIAT_DEFAULT)
 
-    """Used to improve access to maps"""
+    """Used to improve access to maps, the index should be CRYPTO_INDEX or FIAT_INDEX"""
     @staticmethod
-    def get_map_match(curr_map: dict, string: str):
-        string_lower = string.lower()
-
-        for key in curr_map:
-            if string_lower == key.lower():
-                return key
-
-            value_list = curr_map[key]
-            for value in value_list:
-                if string_lower == value.lower():
-                    return key
-
-        return None
+    def get_map_match(curr_index: dict, string: str):
+        return curr_index.get(string.casefold())
 
 class Currency:
     def __init__(self, crypto: str, fiat: str):
@@ -59,126 +59,361 @@ class Currency:
 
         self.pair = f"{crypto}-{fiat}"
 
+"""Raised when hourly candles are missing and the gap fill rule is 'flag'"""
+class CandleGapError(IOError):
+    def __init__(self, message: str, missing: list):
+        super().__init__(message)
+        self.missing = missing
+
 class Coinbase:
     API_URL = "https://api.exchange.coinbase.com"
     CANDLES_TO_RETRIEVE = 300
+    GRANULARITIES = [60, 300, 900, 3600, 21600, 86400]
+    # Extra candles requested before a lookup time, in case there were no trades at that exact time
+    LOOKUP_MARGIN = 5
     MINS_IN_HOUR = 60
     SECS_IN_MINUTE = 60
 
-    def __init__(self, currency: Currency, interval: int = 60):
+    # Maximum number of range requests fetched at once (1 fetches sequentially)
+    # The semaphore is shared by every instance so that concurrent callers share the same request budget
+    MAX_CONCURRENT_REQUESTS = 4
+    REQUEST_SEMAPHORE = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+    # Paces requests from every instance to stay under coinbase's public rate limit (10 requests per second)
+    RATE_LIMITER = RateLimiter()
+
+    # How hourly candles that coinbase still doesn't return after being requested again are filled in ('carry' or 'flag')
+    GAP_FILLS = ["carry", "flag"]
+    GAP_FILL = "carry"
+
+    # Responses cached by (pair, granularity, start candle, end candle), shared by every instance (None disables)
+    CACHE = TTLCache(ttl=60, max_size=256)
+
+    def __init__(self, currency: Currency, interval: int = 60, store: CandleStore = None):
         self.currency = currency
         self.interval = interval
+        self.store = store
 
     """Retrieves last 300 hourly prices (according to interval)"""
     def price_list(self):
+        return self.hourly_candles().open
+
+    """Retrieves last 300 hourly candles (according to interval), newest first
+    Candles are exactly an hour apart: missing candles are requested again, and any still missing are filled in according to GAP_FILL"""
+    def hourly_candles(self):
         historical_data = self.__retrieve_from_coinbase()
+        if len(historical_data) == 0:
+            raise IOError(f"No candles were returned for {self.currency.pair}")
 
         # Parse https://docs.pro.coinbase.com/#get-historic-rates
-        data = []
-        for entry in historical_data[::round(self.MINS_IN_HOUR / self.interval)]:
-            data.append({
-                "time": entry[0],
-                "low": entry[1],
-                "high": entry[2],
-                "open": entry[3],
-                "close": entry[4],
-                "volume": entry[5]
-            })
-
-        # Ensure timestamps are every hour
-        for i in range(len(data) - 1):
-            # logging.info(datetime.fromtimestamp(self.data[i]['time']).strftime("%d/%m/%Y - %H:%M"))
-            time_diff = data[i]['time'] - data[i + 1]['time']
-            # logging.info(time_diff)
-
-            required_diff = self.SECS_IN_MINUTE * self.MINS_IN_HOUR
-            if time_diff != required_diff:
-                logging.error(f"For index {i} the time diff is not {required_diff}, but is {time_diff}")
-            # assert time_diff == required_diff
-
-        """ print information
-        for entry in self.data:
-            time_formatted = datetime.fromtimestamp(entry['time']).strftime("[%d/%m/%Y] %H:%M:%S")
-            logging.info(time_formatted + " - " + str(entry['open']))
-        """
-
-        prices = []
-        for entry in data:
-            prices.append(entry['open'])
-
-        return prices
+        # Hours are counted back from the newest candle, so with intervals under an hour the hourly candles are every nth candle
+        entries = {entry[0]: entry for entry in historical_data}
+        newest = max(entries)
+        hour_times = range(newest, min(entries) - 1, -self.SECS_IN_MINUTE * self.MINS_IN_HOUR)
+
+        missing = [t for t in hour_times if t not in entries]
+        if len(missing) > 0:
+            logging.warning(f"{len(missing)} of the last {len(hour_times)} hourly candles are missing for {self.currency.pair}")
+            for entry in self.backfill(missing):
+                entries[entry[0]] = entry
+
+        return self.fill_gaps(entries, hour_times)
+
+    """Request only the candles at the times given (unix timestamps at the interval granularity) from coinbase
+    Consecutive times are requested together, and the cache and candle store's record of what's been retrieved are bypassed
+    The candle store records what has been backfilled, so candles coinbase doesn't have (eg. hours without trades) are only requested again once"""
+    def backfill(self, times: list):
+        granularity = self.interval * self.SECS_IN_MINUTE
+        if self.store is not None:
+            requested = len(times)
+            times = self.store.not_backfilled(self.currency.pair, granularity, times)
+            if len(times) < requested:
+                logging.info(f"{requested - len(times)} of the missing candles have already been requested again")
+            if len(times) == 0:
+                return []
+
+        logging.info(f"Requesting {len(times)} missing candles again")
+        ranges = []
+        for t in sorted(times):
+            if len(ranges) > 0 and t - ranges[-1][1] <= self.SECS_IN_MINUTE * self.MINS_IN_HOUR:
+                ranges[-1][1] = t
+            else:
+                ranges.append([t, t])
+
+        request_time = calendar.timegm(datetime.utcnow().timetuple())
+        found = []
+        for range_start, range_end in ranges:
+            for chunk_start, chunk_end in self.chunk_range(range_start, range_end, granularity):
+                candles = self.__request_candles(datetime.utcfromtimestamp(chunk_start), datetime.utcfromtimestamp(chunk_end), granularity)
+                found += candles
+                if self.store is not None:
+                    self.store.add(self.currency.pair, granularity, candles, chunk_start, chunk_end, request_time)
+                    self.store.add_backfilled(self.currency.pair, granularity, chunk_start, chunk_end, request_time)
+
+        if self.store is not None:
+            self.store.save(self.currency.pair, granularity)
+
+        wanted = set(times)
+        backfilled = [entry for entry in found if entry[0] in wanted]
+        logging.info(f"Backfilled {len(backfilled)} of {len(times)} missing candles with {len(ranges)} ranges")
+        Metrics.increment("candle_gaps_total", {'result': "backfilled"}, len(backfilled))
+        return backfilled
+
+    """Candles at each of the hour times given (newest first), filling in any that are missing according to GAP_FILL
+    'carry' uses the close of the previous candle (with no volume, the same as an hour without trades), 'flag' raises CandleGapError
+    Hours older than the oldest real candle have nothing to carry forward, so they're left out (the series stays aligned to the newest hour)"""
+    def fill_gaps(self, entries: dict, hour_times: range):
+        real = [i for i, t in enumerate(hour_times) if t in entries]
+        if len(real) == 0:
+            raise CandleGapError(f"None of the hourly candles were returned for {self.currency.pair}", list(hour_times))
+        hour_times = hour_times[:real[-1] + 1]
+
+        missing = [t for t in hour_times if t not in entries]
+        if len(missing) > 0:
+            Metrics.increment("candle_gaps_total", {'result': self.GAP_FILL}, len(missing))
+            if self.GAP_FILL == "flag":
+                raise CandleGapError(f"{len(missing)} hourly candles are missing for {self.currency.pair} (newest: "
+                                     + datetime.utcfromtimestamp(missing[0]).strftime("%d/%m/%Y - %H:%M") + ")", missing)
+            logging.warning(f"Filling {len(missing)} missing hourly candles for {self.currency.pair} with the previous close")
+
+        # Filled from the oldest, which is a real candle
+        hours = []
+        previous = None
+        for t in reversed(hour_times):
+            entry = entries.get(t)
+            if entry is None:
+                entry = [t, previous[4], previous[4], previous[4], previous[4], 0.0]
+            hours.append(entry)
+            previous = entry
+
+        return Candles.from_coinbase(reversed(hours))
 
     """Query the API for a specific price"""
     def price_days_ago(self, days: int):
         time_ago = datetime.utcnow() - timedelta(days=days)
 
-        historical_data = self.get_historical_prices(time_ago - timedelta(minutes=300), time_ago)
-        historical_time = historical_data[0][0]
-        historical_price = historical_data[0][3]
+        candles = Candles.from_coinbase(self.get_historical_prices(time_ago - timedelta(minutes=300), time_ago))
+        index = candles.index_at_or_before(calendar.timegm(time_ago.timetuple()))
+        if index is None:
+            raise IOError(f"No candle found at or before {time_ago.isoformat()}")
+        historical_time = candles.time[index]
+        historical_price = candles.open[index]
 
-        logging.debug(f"Price {days} days ago was {self.currency.fiat_symbol}{historical_price} (exact time: " + datetime.fromtimestamp(historical_time).strftime("%d/%m/%Y - %H:%M") + ")")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Price {days} days ago was {self.currency.fiat_symbol}{historical_price} (exact time: " + datetime.fromtimestamp(historical_time).strftime("%d/%m/%Y - %H:%M") + ")")
         return historical_price
 
     """Retrieve the un filtered results from coinbase according to the interval"""
     def __retrieve_from_coinbase(self):
-        # Time param info for request
-        time_delta = timedelta(minutes=self.CANDLES_TO_RETRIEVE * self.interval)
-        time_end = datetime.utcnow()
-        time_start = time_end - time_delta
+        # Time param info for request, 300 hours split into pages of at most 300 candles
+        granularity = self.interval * self.SECS_IN_MINUTE
+        end_ts = calendar.timegm(datetime.utcnow().timetuple())
+        start_ts = end_ts - self.CANDLES_TO_RETRIEVE * self.MINS_IN_HOUR * self.SECS_IN_MINUTE
 
-        historical_data = []
+        # Pages are aligned to candles and don't overlap or leave candles between them, newest first
+        ranges = [(datetime.utcfromtimestamp(chunk_start), datetime.utcfromtimestamp(chunk_end), granularity)
+                  for chunk_start, chunk_end in reversed(self.chunk_range(start_ts, end_ts, granularity))]
 
-        # Send request
+        # Send requests, pages are independent so can be fetched concurrently (map keeps them in time order)
         logging.info(f"Retrieving data from coinbase (interval {self.interval} mins)")
-        for i in range(round(self.MINS_IN_HOUR / self.interval)):
-            historical_data += self.get_historical_prices(time_start, time_end)
+        historical_data = []
+        for response in self.fetch_concurrently(ranges):
+            historical_data += response
 
-            time_end -= time_delta
-            time_start -= time_delta
+        return historical_data
 
-            # Ugly hack
-            if i == 0:
-                time_end -= timedelta(minutes=self.interval)
+    """Call get_historical_prices for each (start, end[, granularity]) range, returning the responses in the same order"""
+    def fetch_concurrently(self, ranges: list):
+        if len(ranges) <= 1 or self.MAX_CONCURRENT_REQUESTS <= 1:
+            return [self.get_historical_prices(*args) for args in ranges]
 
-        return historical_data
+        with ThreadPoolExecutor(max_workers=min(len(ranges), self.MAX_CONCURRENT_REQUESTS)) as executor:
+            return list(executor.map(lambda args: self.get_historical_prices(*args), ranges))
 
     """Get prices closest to the times given, but they cannot be later"""
     def get_prices_closest_to_time(self, *args: datetime):
         earliest = min(args) - timedelta(minutes=self.interval)
         latest = max(args)
 
-        # Map response to ordered list of time -> price
-        response = self.get_historical_prices(earliest, latest)
-        time_prices = ((datetime.utcfromtimestamp(entry[0]), entry[3]) for entry in response)
-        time_prices = sorted(time_prices, key=lambda x: x[0])
+        candles = Candles.from_coinbase(self.get_historical_prices(earliest, latest))
+        return tuple(self.prices_at_or_before(candles, args))
+
+    """Get the prices closest to the times given (but not later), using as few requests as possible
+    Lookups are (time, granularity) pairs, where the granularity (seconds) is the coarsest resolution acceptable for that time"""
+    def get_prices_at_times(self, lookups: list):
+        prices = [None] * len(lookups)
+        requests_planned = self.plan_requests(lookups, datetime.utcnow())
+        logging.debug(f"Resolving {len(lookups)} price lookups with {len(requests_planned)} requests")
+
+        responses = self.fetch_concurrently([request[:3] for request in requests_planned])
+        for response, (start, end, granularity, indexes) in zip(responses, requests_planned):
+            request_prices = self.prices_at_or_before(Candles.from_coinbase(response), [lookups[i][0] for i in indexes])
+            for i, price in zip(indexes, request_prices):
+                prices[i] = price
+
+        return prices
+
+    """Same as get_prices_at_times, but yields {lookup index: price} for each request as soon as it completes (finer granularities are requested first)
+    The price is None for lookups whose request failed, and lookups that haven't completed after timeout seconds are left out"""
+    def iter_prices_at_times(self, lookups: list, timeout: float = None):
+        requests_planned = self.plan_requests(lookups, datetime.utcnow())
+        logging.debug(f"Resolving {len(lookups)} price lookups with {len(requests_planned)} requests")
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(len(requests_planned), self.MAX_CONCURRENT_REQUESTS)))
+        futures = {}
+        try:
+            for request in requests_planned:
+                futures[executor.submit(self.get_historical_prices, *request[:3])] = request
+            for future in as_completed(futures, timeout):
+                start, end, granularity, indexes = futures[future]
+                # noinspection PyBroadException
+                try:
+                    request_prices = self.prices_at_or_before(Candles.from_coinbase(future.result()), [lookups[i][0] for i in indexes])
+                except Exception:
+                    logging.exception(f"Couldn't retrieve {granularity}s candles from {start} to {end}", exc_info=True)
+                    request_prices = [None] * len(indexes)
+
+                yield dict(zip(indexes, request_prices))
+        except FuturesTimeoutError:
+            logging.warning(f"Price lookups weren't complete after {timeout:.1f} seconds")
+        finally:
+            # Requests that haven't started are cancelled, and requests still running are left to finish in the background
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    """Open prices of the candles closest to (but not later than) each time, raises IOError if a time has no candle"""
+    @staticmethod
+    def prices_at_or_before(candles: Candles, times: list):
+        timestamps = [calendar.timegm(required_time.timetuple()) for required_time in times]
 
         prices = []
-        for required_time in args:
-            closest_floor = max(entry for entry in time_prices if entry[0] < required_time)
-            prices.append(closest_floor[1])
+        for required_time, index in zip(times, candles.indexes_at_or_before(timestamps)):
+            if index is None:
+                raise IOError(f"No candle found at or before {required_time.isoformat()}")
+            prices.append(candles.open[index])
+
+        return prices
 
-        return tuple(prices)
+    """Plan the smallest set of (start, end, granularity) requests that cover every lookup
+    Finer requests are planned first, and coarser lookups are resolved by them if they already cover the time needed"""
+    @classmethod
+    def plan_requests(cls, lookups: list, time_now: datetime):
+        now_ts = calendar.timegm(time_now.timetuple())
+        planned = []
+
+        for granularity in sorted(set(lookup[1] for lookup in lookups)):
+            if granularity not in cls.GRANULARITIES:
+                raise ValueError(f"Granularity must be one of {cls.GRANULARITIES}, not {granularity}")
+
+            pending = sorted((calendar.timegm(lookups[i][0].timetuple()), i) for i in range(len(lookups)) if lookups[i][1] == granularity)
+            for required_time, i in pending:
+                # Reuse any request that already covers this time at the same or a finer granularity
+                for request in planned:
+                    if request[0] <= required_time - required_time % request[2] and required_time <= request[1]:
+                        request[3].append(i)
+                        break
+                else:
+                    start = required_time - required_time % granularity - cls.LOOKUP_MARGIN * granularity
+                    end = min(start + (cls.CANDLES_TO_RETRIEVE - 1) * granularity, now_ts)
+                    planned.append([start, end, granularity, [i]])
+
+        return [(datetime.utcfromtimestamp(start), datetime.utcfromtimestamp(end), granularity, indexes)
+                for start, end, granularity, indexes in planned]
 
     """Get historical prices from coinbase unaltered
+    Responses are cached for a short time, and requests for the same candles are coalesced into one
+    If a candle store is used then only the ranges that aren't stored yet are requested
+    Granularity is in seconds, and defaults to the interval
     Date objects must be UTC"""
-    def get_historical_prices(self, start: datetime, end: datetime):
+    def get_historical_prices(self, start: datetime, end: datetime, granularity: int = None):
+        if granularity is None:
+            granularity = self.interval * self.SECS_IN_MINUTE
+
+        start_ts = calendar.timegm(start.timetuple())
+        end_ts = calendar.timegm(end.timetuple())
+        if self.CACHE is None:
+            return self.__load_historical_prices(start_ts, end_ts, granularity)
+
+        key = (self.currency.pair, granularity, start_ts // granularity, end_ts // granularity)
+        return self.CACHE.get_or_load(key, lambda: self.__load_historical_prices(start_ts, end_ts, granularity))
+
+    """Get historical prices from the candle store (if used) and coinbase
+    The list returned may be shared through the cache so must not be modified"""
+    def __load_historical_prices(self, start_ts: int, end_ts: int, granularity: int):
+        if self.store is None:
+            chunks = self.chunk_range(start_ts, end_ts, granularity)
+            return [entry for chunk_start, chunk_end in reversed(chunks)
+                    for entry in self.__request_candles(datetime.utcfromtimestamp(chunk_start), datetime.utcfromtimestamp(chunk_end), granularity)]
+
+        pair = self.currency.pair
+        request_time = calendar.timegm(datetime.utcnow().timetuple())
+
+        # If candles were retrieved recently enough then the candles newer than that request are used as they were (including the candle
+        # that hadn't closed yet), so nothing is requested if the rest of the range is stored
+        request_end = end_ts
+        fresh_since = self.store.fresh_since(pair, granularity, request_time)
+        if fresh_since is not None:
+            request_end = min(end_ts, fresh_since - fresh_since % granularity - granularity)
+            logging.debug(f"Candle store was updated {request_time - fresh_since} seconds ago, using the stored candles after that")
+
+        # Build what can be built from stored finer candles, so only the rest is requested
+        rolled_up = self.store.rollup(pair, granularity, start_ts, request_end)
+
+        missing_ranges = self.store.missing_ranges(pair, granularity, start_ts, request_end)
+        for range_start, range_end in missing_ranges:
+            for chunk_start, chunk_end in self.chunk_range(range_start, range_end, granularity):
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug(f"Candle store missing {pair} data from " + datetime.utcfromtimestamp(chunk_start).strftime("%d/%m/%Y - %H:%M") +
+                                  " to " + datetime.utcfromtimestamp(chunk_end).strftime("%d/%m/%Y - %H:%M"))
+
+                candles = self.__request_candles(datetime.utcfromtimestamp(chunk_start), datetime.utcfromtimestamp(chunk_end), granularity)
+                self.store.add(pair, granularity, candles, chunk_start, chunk_end, request_time)
+
+        if len(missing_ranges) > 0 or rolled_up > 0:
+            self.store.save(pair, granularity)
+
+        return self.store.get(pair, granularity, start_ts, end_ts)
+
+    """Split a range of unix timestamps into ranges of at most 300 candles (the most coinbase returns per request)
+    Ranges start on a candle boundary so that no candles fall between them"""
+    @classmethod
+    def chunk_range(cls, start_ts: int, end_ts: int, granularity: int):
+        chunks = []
+        chunk_start = start_ts + -start_ts % granularity
+        while chunk_start <= end_ts:
+            chunk_end = min(end_ts, chunk_start + (cls.CANDLES_TO_RETRIEVE - 1) * granularity)
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = chunk_end + granularity
+
+        return chunks
+
+    """Request candles from coinbase for a range of at most 300 candles"""
+    def __request_candles(self, start: datetime, end: datetime, granularity: int):
         params = {
             "start": start.isoformat(),
             "end": end.isoformat(),
-            "granularity": self.interval * self.SECS_IN_MINUTE
+            "granularity": granularity
         }
 
-        json_text = self.__get_request(f"{self.API_URL}/products/{self.currency.pair}/candles", params=params)
+        json_text = self.__get_request(f"{self.API_URL}/products/{self.currency.pair}/candles", params=params, endpoint="candles")
         return json.loads(json_text)
 
-    @staticmethod
-    def __get_request(url: str, params: dict):
+    @classmethod
+    def __get_request(cls, url: str, params: dict, endpoint: str):
+        attempt = 0
         while True:
-            resp = requests.get(url, params=params)
+            cls.RATE_LIMITER.acquire()
+            with cls.REQUEST_SEMAPHORE, Metrics.timer("coinbase_request_seconds", {'endpoint': endpoint}):
+                resp = HttpClient.get(url, params=params)
+            Metrics.increment("coinbase_requests_total", {'endpoint': endpoint, 'code': resp.status_code})
 
             if resp.status_code == 429:
-                logging.info("GET request received 429 (timeout). Waiting 1 second and trying again")
-                time.sleep(1)
+                Metrics.increment("coinbase_rate_limited_total", {'endpoint': endpoint})
+                attempt += 1
+                logging.info(f"GET request received 429 (rate limited), backing off (attempt {attempt})")
+                wait = cls.RATE_LIMITER.backoff(attempt)
+                logging.debug(f"Waited {wait:.2f} seconds, trying again")
                 continue
             elif resp.status_code != 200:
                 logging.info("API error - Response code was not 200 or 429")
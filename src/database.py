@@ -0,0 +1,27 @@
+import sqlite3
+
+"""Connections to the SQLite files shared between processes (the slack outbox and notifier state)"""
+class Database:
+    # Seconds to wait for another process to finish writing
+    TIMEOUT = 30
+
+    """Open a connection in autocommit mode (transactions are started explicitly), closed at the end of a with block
+    Write ahead logging lets readers carry on while another process writes"""
+    @classmethod
+    def connect(cls, file: str):
+        db = sqlite3.connect(file, timeout=cls.TIMEOUT, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return Transaction(db)
+
+"""Closes a connection at the end of a with block (sqlite3's own context manager only commits)"""
+class Transaction:
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and self.db.in_transaction:
+            self.db.execute("ROLLBACK")
+        self.db.close()
@@ -0,0 +1,258 @@
+import logging
+import base64
+import calendar
+import hashlib
+import json
+import math
+import random
+import socketserver
+import struct
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import urllib.parse as urlparse
+
+from src.websocket import WebSocket
+
+"""http.server.ThreadingHTTPServer was only added in python 3.7"""
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+"""Local stand ins for coinbase, its ticker feed and slack, used by the benchmarks
+Each server runs on its own thread, and can add latency to every request and rate limit a fraction of them"""
+class FakeServer:
+    def __init__(self, latency: float = 0.0, rate_429: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.create_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        logging.info(f"{type(self).__name__} started on {self.url}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    """Handler class that passes requests to this server's handle method"""
+    def create_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # noinspection PyPep8Naming
+            def do_GET(self):
+                fake.respond(self, "GET")
+
+            # noinspection PyPep8Naming
+            def do_POST(self):
+                fake.respond(self, "POST")
+
+            def log_message(self, format_, *args):
+                pass
+
+        return Handler
+
+    def respond(self, request: BaseHTTPRequestHandler, method: str):
+        body = request.rfile.read(int(request.headers.get('Content-Length', 0)))
+        with self.lock:
+            self.requests += 1
+            rate_limited = self.random.random() < self.rate_429
+            if rate_limited:
+                self.rate_limited += 1
+
+        time.sleep(self.latency)
+        if rate_limited:
+            status, response = 429, b""
+        else:
+            status, response = self.handle(method, urlparse.urlparse(request.path), body)
+
+        request.send_response(status)
+        request.send_header("Content-Length", str(len(response)))
+        request.end_headers()
+        request.wfile.write(response)
+
+    """Return the (status code, body) for a request"""
+    def handle(self, method: str, path: urlparse.ParseResult, body: bytes):
+        raise NotImplementedError
+
+"""Serves the products and candles endpoints, with a price that follows a sine wave (so every run sees the same prices)"""
+class FakeCoinbase(FakeServer):
+    PAIRS = ["BTC-USD", "BTC-EUR", "BTC-GBP", "ETH-USD", "ETH-EUR", "LTC-USD"]
+
+    @staticmethod
+    def price(timestamp: int):
+        return 20000 + 1500 * math.sin(timestamp / 86400) + 300 * math.sin(timestamp / 7200)
+
+    def handle(self, method: str, path: urlparse.ParseResult, body: bytes):
+        if path.path == "/products":
+            products = [{"id": pair, "base_currency": pair.split("-")[0], "quote_currency": pair.split("-")[1], "status": "online"}
+                        for pair in self.PAIRS]
+            return 200, json.dumps(products).encode()
+
+        parts = path.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "products" or parts[2] != "candles" or parts[1] not in self.PAIRS:
+            return 404, b""
+
+        query = urlparse.parse_qs(path.query)
+        granularity = int(query['granularity'][0])
+        start = self.parse_time(query['start'][0])
+        end = min(self.parse_time(query['end'][0]), int(time.time()))
+
+        # Newest first, including candles that start within the range
+        candles = []
+        candle_time = end - end % granularity
+        while candle_time >= start:
+            price = self.price(candle_time)
+            candles.append([candle_time, price * 0.995, price * 1.005, price, self.price(candle_time + granularity), 12.5])
+            candle_time -= granularity
+
+        return 200, json.dumps(candles[:300]).encode()
+
+    """Unix timestamp of an ISO 8601 UTC time (as sent by Coinbase.get_historical_prices)"""
+    @staticmethod
+    def parse_time(string: str):
+        return calendar.timegm(time.strptime(string.rstrip("Z").split(".")[0], "%Y-%m-%dT%H:%M:%S"))
+
+"""Accepts webhook and response url posts, and keeps the last one"""
+class FakeSlack(FakeServer):
+    def __init__(self, latency: float = 0.0, rate_429: float = 0.0, seed: int = 0):
+        super().__init__(latency, rate_429, seed)
+        self.last_post = None
+
+    def handle(self, method: str, path: urlparse.ParseResult, body: bytes):
+        if method != "POST":
+            return 405, b""
+
+        self.last_post = body
+        return 200, b"ok"
+
+"""Websocket stand in for coinbase's ticker feed, with prices from FakeCoinbase.price
+Each connection must subscribe first, then it's sent ticks_per_connection ticks (tick_interval seconds apart, starting at start,
+carrying on from the last connection) and a heartbeat every 10 ticks, before the connection is closed so the client has to reconnect.
+Connections after the last are refused (with a 503), as are rate limited connections (with a 429)"""
+class FakeTickerFeed(FakeServer):
+    HEARTBEAT_EVERY = 10
+
+    def __init__(self, start: float, ticks_per_connection: int = 50, connections: int = 2, tick_interval: float = 30,
+                 pair: str = "BTC-USD", latency: float = 0.0, rate_429: float = 0.0, seed: int = 0):
+        super().__init__(latency, rate_429, seed)
+        self.start_time = start
+        self.ticks_per_connection = ticks_per_connection
+        self.max_connections = connections
+        self.tick_interval = tick_interval
+        self.pair = pair
+
+        self.connections = 0
+        self.subscriptions = []
+        self.ticks_sent = 0
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.server.server_address[1]}"
+
+    """Time of the last tick that will be sent"""
+    @property
+    def end_time(self):
+        return self.start_time + (self.ticks_per_connection * self.max_connections - 1) * self.tick_interval
+
+    def create_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # noinspection PyPep8Naming
+            def do_GET(self):
+                fake.connect(self)
+
+            def log_message(self, format_, *args):
+                pass
+
+        return Handler
+
+    """Complete the websocket handshake and send the connection's ticks"""
+    def connect(self, request: BaseHTTPRequestHandler):
+        with self.lock:
+            self.requests += 1
+            rate_limited = self.random.random() < self.rate_429
+            if rate_limited:
+                self.rate_limited += 1
+            connection = self.connections
+            if not rate_limited and connection < self.max_connections:
+                self.connections += 1
+
+        time.sleep(self.latency)
+        if rate_limited or connection >= self.max_connections:
+            request.send_response(429 if rate_limited else 503)
+            request.send_header("Content-Length", "0")
+            request.end_headers()
+            return
+
+        key = request.headers.get('Sec-WebSocket-Key', "")
+        request.send_response(101)
+        request.send_header("Upgrade", "websocket")
+        request.send_header("Connection", "Upgrade")
+        request.send_header("Sec-WebSocket-Accept", base64.b64encode(hashlib.sha1((key + WebSocket.GUID).encode()).digest()).decode())
+        request.end_headers()
+
+        subscribe = json.loads(self.recv_text(request))
+        if subscribe.get('type') != "subscribe":
+            self.send_frame(request, WebSocket.OP_CLOSE, b"")
+            return
+        with self.lock:
+            self.subscriptions.append(subscribe.get('product_ids', []))
+        self.send_json(request, {"type": "subscriptions", "channels": [{"name": channel, "product_ids": subscribe.get('product_ids', [])}
+                                                                       for channel in subscribe.get('channels', [])]})
+
+        first_tick = connection * self.ticks_per_connection
+        for tick in range(first_tick, first_tick + self.ticks_per_connection):
+            timestamp = self.start_time + tick * self.tick_interval
+            tick_time = datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            if tick % self.HEARTBEAT_EVERY == 0:
+                self.send_json(request, {"type": "heartbeat", "sequence": tick, "product_id": self.pair, "time": tick_time})
+            self.send_json(request, {"type": "ticker", "sequence": tick, "product_id": self.pair,
+                                     "price": f"{FakeCoinbase.price(int(timestamp)):.2f}", "time": tick_time})
+            with self.lock:
+                self.ticks_sent += 1
+
+        self.send_frame(request, WebSocket.OP_CLOSE, b"")
+
+    def send_json(self, request: BaseHTTPRequestHandler, data: dict):
+        self.send_frame(request, WebSocket.OP_TEXT, json.dumps(data).encode())
+
+    """Server frames aren't masked"""
+    @staticmethod
+    def send_frame(request: BaseHTTPRequestHandler, opcode: int, payload: bytes):
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 2 ** 16:
+            header += bytes([126]) + struct.pack("!H", len(payload))
+        else:
+            header += bytes([127]) + struct.pack("!Q", len(payload))
+        request.wfile.write(header + payload)
+
+    """Read a (single frame) text message from the client, client frames are always masked"""
+    @staticmethod
+    def recv_text(request: BaseHTTPRequestHandler):
+        header = request.rfile.read(2)
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", request.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", request.rfile.read(8))[0]
+
+        mask = request.rfile.read(4)
+        return bytes(b ^ mask[i % 4] for i, b in enumerate(request.rfile.read(length))).decode("utf-8")
@@ -1,39 +1,107 @@
 import logging
 import json
+import os
+import time
 
+"""State of the last post for a script
+It's saved to a json file, or to a state store (shared by every script) if one is given
+If neither is given then the history is only kept in memory (eg. for backtesting)"""
 class History:
-    def __init__(self, file: str,):
+    def __init__(self, file: str = None, store=None, script_name: str = None, pair: str = None, data: dict = None):
         self.file_name = file
-        logging.info("Loading script history data")
+        self.store = store
+        self.script_name = script_name
+        self.pair = pair
+
+        self.ema_reset = True
+        self.price = None
+        self.rising = True
+        self.last_ema = None
+
+        # Posts made since the last save, for the store's alert log
+        self.posts = []
+        self.saved_data = None
+
+        if data is not None:
+            self.set_data(data)
+            return
+
+        if file is None:
+            return
 
+        logging.info("Loading script history data")
         try:
             with open(file, "r") as file:
                 # Read file
-                data = json.loads(file.read())
-                last_post = data['last_post']
-
-                self.ema_reset = data['ema_reset']
-
-                self.price = last_post['price']
-                self.rising = last_post['rising']
+                self.set_data(json.loads(file.read()))
         except IOError:
             logging.warning("Couldn't load file, using default values")
-            self.ema_reset = True
-            self.price = None
-            self.rising = True
 
-    def save(self):
-        logging.info(f"Updating {self.file_name}")
+    """Load from a state store, data can be given if it has already been loaded (eg. by StateStore.load_all)
+    Data should be an empty dict if the store doesn't have the script, in which case its json file (if there is one) is used instead
+    and will be saved to the store"""
+    @classmethod
+    def from_store(cls, store, script_name: str, pair: str, file: str = None, data: dict = None):
+        if data is None:
+            data = store.load(script_name) or {}
+
+        if len(data) == 0 and file is not None and os.path.exists(file):
+            history = cls(file)
+            history.file_name = None
+            history.store = store
+            history.script_name = script_name
+            history.pair = pair
+            history.saved_data = None
+            return history
 
-        new_data = {
+        return cls(store=store, script_name=script_name, pair=pair, data=data or None)
+
+    def set_data(self, data: dict):
+        last_post = data['last_post']
+
+        self.ema_reset = data['ema_reset']
+        self.last_ema = data.get('ema')
+
+        self.price = last_post['price']
+        self.rising = last_post['rising']
+        self.saved_data = self.get_data()
+
+    def get_data(self):
+        data = {
             'ema_reset': self.ema_reset,
             'last_post': {
                 'price': self.price,
                 'rising': self.rising
             }
         }
+        if self.last_ema is not None:
+            data['ema'] = self.last_ema
+
+        return data
+
+    """Record that a post was made"""
+    def record_post(self, price: float, rising: bool, ema: float = None):
+        self.price = price
+        self.rising = rising
+        self.ema_reset = False
+        self.posts.append((time.time(), price, rising, ema))
+
+    """Save if anything has changed since the history was loaded or last saved"""
+    def save(self):
+        new_data = self.get_data()
+        if new_data == self.saved_data and len(self.posts) == 0:
+            return
+
+        if self.store is not None:
+            logging.info(f"Updating the history of {self.script_name} in {self.store.file}")
+            self.store.save(self.script_name, self.pair, new_data, self.posts)
+        elif self.file_name is not None:
+            logging.info(f"Updating {self.file_name}")
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("New data: \n" + json.dumps(new_data, indent=4))
 
-        logging.debug("New data: \n" + json.dumps(new_data, indent=4))
+            with open(self.file_name, "w") as f:
+                json.dump(new_data, f, indent=4)
 
-        with open(self.file_name, "w") as f:
-            json.dump(new_data, f, indent=4)
+        self.saved_data = new_data
+        self.posts = []
@@ -0,0 +1,71 @@
+import logging
+import threading
+
+"""Shared HTTP session used by the coinbase and slack clients
+Connections are kept alive in a pool per host, so repeated requests don't pay for a new TCP and TLS handshake each time
+Requests is only imported when the first session is created, as importing it is slow and some runs never make a request"""
+class HttpClient:
+    # Connections kept open per host, and number of hosts to keep pools for
+    POOL_SIZE = 10
+    POOL_HOSTS = 4
+
+    # Timeouts in seconds
+    CONNECT_TIMEOUT = 5.0
+    READ_TIMEOUT = 15.0
+
+    # Connection errors are always retried, status codes only for idempotent requests (ie. not posting to slack)
+    # 429 is not included as coinbase rate limiting is handled by the Coinbase class
+    RETRIES = 2
+    RETRY_BACKOFF = 0.5
+    RETRY_STATUS_CODES = [500, 502, 503, 504]
+
+    session = None
+    session_lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, pool_size: int = None, connect_timeout: float = None, read_timeout: float = None, retries: int = None):
+        with cls.session_lock:
+            if pool_size is not None:
+                cls.POOL_SIZE = pool_size
+            if connect_timeout is not None:
+                cls.CONNECT_TIMEOUT = connect_timeout
+            if read_timeout is not None:
+                cls.READ_TIMEOUT = read_timeout
+            if retries is not None:
+                cls.RETRIES = retries
+
+            # Recreate the session with the new settings on next use
+            if cls.session is not None:
+                cls.session.close()
+                cls.session = None
+
+        logging.debug(f"HTTP client configured (pool size {cls.POOL_SIZE}, timeouts {cls.CONNECT_TIMEOUT}s/{cls.READ_TIMEOUT}s, retries {cls.RETRIES})")
+
+    @classmethod
+    def get_session(cls):
+        with cls.session_lock:
+            if cls.session is None:
+                cls.session = cls.create_session()
+            return cls.session
+
+    @classmethod
+    def create_session(cls):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=cls.RETRIES, status_forcelist=cls.RETRY_STATUS_CODES, backoff_factor=cls.RETRY_BACKOFF, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=cls.POOL_HOSTS, pool_maxsize=cls.POOL_SIZE, max_retries=retry)
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @classmethod
+    def get(cls, url: str, params: dict = None):
+        return cls.get_session().get(url, params=params, timeout=(cls.CONNECT_TIMEOUT, cls.READ_TIMEOUT))
+
+    @classmethod
+    def post(cls, url: str, data: str, headers: dict = None):
+        return cls.get_session().post(url, data=data, headers=headers, timeout=(cls.CONNECT_TIMEOUT, cls.READ_TIMEOUT))
@@ -1,7 +1,11 @@
 import logging
 from datetime import datetime
+import atexit
+import queue
 import sys
 import os
+import threading
+import time
 
 """Custom formatter that indents newlines the same amount as the first line
 Requires %(message)s to be the last thing"""
@@ -14,6 +18,10 @@ class CustMultiLineFormatter(logging.Formatter):
         if self.usesTime():
             record.asctime = self.formatTime(record, self.datefmt)
         initial_str = self.formatMessage(record)
+
+        # Most records are a single line, so don't need anything else doing to them
+        if not record.exc_info and not record.exc_text and not record.stack_info and "\n" not in msg:
+            return initial_str
         s = initial_str
 
         if record.exc_info:
@@ -41,18 +49,89 @@ class CustMultiLineFormatter(logging.Formatter):
 
         return s
 
+    """Reuse the formatted time when records are logged in the same second, only the milliseconds change"""
+    def formatTime(self, record: logging.LogRecord, datefmt: str = None):
+        if datefmt is not None:
+            return super().formatTime(record, datefmt)
+
+        second = int(record.created)
+        cached = getattr(self, "cached_time", None)
+        if cached is None or cached[0] != second:
+            cached = (second, time.strftime(self.default_time_format, self.converter(record.created)))
+            self.cached_time = cached
+
+        return self.default_msec_format % (cached[1], record.msecs)
+
 """Filter class to restrict stdout handler from posting messages handled by stderr handler"""
 class StdOutFilter(logging.Filter):
     def filter(self, record: logging.LogRecord):
         return record.levelno < logging.ERROR
 
+"""Handler that passes records to the logging thread without formatting them
+logging.handlers.QueueHandler isn't used as it formats every message (so records can be pickled), and logging.handlers is slow to import"""
+class QueueHandler(logging.Handler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__()
+        self.queue = log_queue
+
+    def emit(self, record: logging.LogRecord):
+        # noinspection PyBroadException
+        try:
+            self.queue.put(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    """Merge the args into the message (as logging.handlers.QueueHandler.prepare does), so that objects passed as args
+    that change after the call don't change the message. Exceptions are still formatted by the logging thread"""
+    @staticmethod
+    def prepare(record: logging.LogRecord):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+"""Thread that formats and writes records from a QueueHandler to the handlers given (at each handler's level)"""
+class QueueListener:
+    def __init__(self, log_queue: queue.Queue, handlers: list):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.thread = threading.Thread(target=self.run, name="logging", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    """Write out the records already queued and stop the thread"""
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+        for handler in self.handlers:
+            handler.flush()
+
 class LogSetup:
+    # Log file rotation
+    ROTATIONS = ["size", "daily", "none"]
+    MAX_BYTES = 10 * 1024 * 1024
+    BACKUP_COUNT = 5
+
+    listener = None
+
+    """Level is the lowest level logged (messages below it are dropped before they're formatted)
+    If queued then records are formatted and written by a separate thread, so logging doesn't block the thread making the call
+    Log files are rotated when they reach MAX_BYTES ('size') or at midnight ('daily'), or 'none' creates a new file every run"""
     @staticmethod
-    def setup(stdout: bool, stderr: bool, file: bool, location: str):
+    def setup(stdout: bool, stderr: bool, file: bool, location: str, level: int = logging.DEBUG, queued: bool = False, rotation: str = "size"):
         # Basic setup
         logger = logging.getLogger()
         logging.addLevelName(logging.WARNING, "WARN")
-        logger.setLevel(logging.DEBUG)
 
         log_formatter = CustMultiLineFormatter("%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s] %(message)s")
         log_formatter.default_msec_format = '%s.%03d'
@@ -61,36 +140,73 @@ class LogSetup:
         logging.getLogger("requests").setLevel(logging.INFO)
         logging.getLogger("urllib3").setLevel(logging.INFO)
 
+        handlers = []
+
         # Standard output handler
         if stdout:
             stdout_handler = logging.StreamHandler(sys.stdout)
             stdout_handler.setFormatter(log_formatter)
-            stdout_handler.setLevel(logging.DEBUG)
+            stdout_handler.setLevel(level)
             stdout_handler.addFilter(StdOutFilter())
-            logger.addHandler(stdout_handler)
+            handlers.append(stdout_handler)
 
         # Standard error handler
         if stdout or stderr:
             stderr_handler = logging.StreamHandler(sys.stderr)
             stderr_handler.setFormatter(log_formatter)
-            stderr_handler.setLevel(logging.ERROR)
-            logger.addHandler(stderr_handler)
+            stderr_handler.setLevel(max(level, logging.ERROR))
+            handlers.append(stderr_handler)
 
         # File handler
         if file:
             if not os.path.isdir(location):
                 os.makedirs(location, exist_ok=True)
 
-            file_handler = logging.FileHandler(f"{location}/" + datetime.now().strftime("%Y-%m-%d %H;%M;%S") + ".txt")
+            # Imported here as it's slow to import, and isn't needed by runs that don't log to files
+            from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+
+            if rotation == "size":
+                file_handler = RotatingFileHandler(f"{location}/log.txt", maxBytes=LogSetup.MAX_BYTES,
+                                                   backupCount=LogSetup.BACKUP_COUNT, encoding="utf-8")
+            elif rotation == "daily":
+                file_handler = TimedRotatingFileHandler(f"{location}/log.txt", when="midnight",
+                                                        backupCount=LogSetup.BACKUP_COUNT, encoding="utf-8")
+            else:
+                file_handler = logging.FileHandler(f"{location}/" + datetime.now().strftime("%Y-%m-%d %H;%M;%S") + ".txt")
             file_handler.setFormatter(log_formatter)
-            file_handler.setLevel(logging.DEBUG)
-            logger.addHandler(file_handler)
+            file_handler.setLevel(level)
+            handlers.append(file_handler)
+
+        # Messages below every handler's level are dropped by the logger, before a record is created
+        # Without any handlers, logging would fall back to printing to stderr
+        if len(handlers) == 0:
+            logger.addHandler(logging.NullHandler())
+            logger.setLevel(logging.CRITICAL)
+        else:
+            logger.setLevel(min(handler.level for handler in handlers))
+
+        if queued and len(handlers) > 0:
+            log_queue = queue.Queue()
+            LogSetup.listener = QueueListener(log_queue, handlers)
+            LogSetup.listener.start()
+            atexit.register(LogSetup.stop)
+            logger.addHandler(QueueHandler(log_queue))
+        else:
+            for handler in handlers:
+                logger.addHandler(handler)
 
         # Override default handling of uncaught exceptions (program crash)
         sys.excepthook = LogSetup.handle_top_exception
 
         logger.info("Logging initialised")
 
+    """Write out any queued records and stop the listener thread"""
+    @staticmethod
+    def stop():
+        if LogSetup.listener is not None:
+            LogSetup.listener.stop()
+            LogSetup.listener = None
+
     # noinspection PyUnusedLocal
     @staticmethod
     def handle_top_exception(exctype, value, traceback):
@@ -0,0 +1,130 @@
+import logging
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+"""Process wide counters and latency histograms, rendered in the Prometheus text format
+Metrics are created the first time they're used, and names should be described in DESCRIPTIONS. Thread safe"""
+class Metrics:
+    PREFIX = "slack_crypto_"
+
+    # Histogram bucket upper bounds (seconds)
+    BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+    DESCRIPTIONS = {
+        "slash_requests_total": "Slash command requests received, by outcome",
+        "slash_request_seconds": "Time taken to give the initial response to a slash command",
+        "slash_signature_seconds": "Time taken to verify the signature of a slash command",
+        "slash_parse_seconds": "Time taken to parse the arguments of a slash command",
+        "slash_command_seconds": "Time from receiving a slash command to posting its prices to the response url",
+        "coinbase_requests_total": "Requests made to coinbase, by endpoint and status code",
+        "coinbase_request_seconds": "Time taken by requests to coinbase (including retries of connection errors), by endpoint",
+        "coinbase_rate_limited_total": "Requests to coinbase that were rate limited (429)",
+        "candle_gaps_total": "Missing hourly candles, by whether they were backfilled from coinbase, carried forward or flagged",
+        "slack_posts_total": "Posts made to slack, by kind (webhook or response_url) and result",
+        "slack_post_seconds": "Time taken by posts to slack, by kind",
+        "slack_outbox_enqueued_total": "Messages queued in the slack outbox",
+        "slack_outbox_coalesced_total": "Unsent messages in the slack outbox replaced by a newer message for the same pair",
+        "slack_outbox_dropped_total": "Messages in the slack outbox given up on after too many failed attempts",
+        "notifier_run_seconds": "Time taken by a webhook notifier run"
+    }
+
+    lock = threading.Lock()
+    counters = {}
+    histograms = {}
+
+    """Increase a counter, labels is a dict of label -> value"""
+    @classmethod
+    def increment(cls, name: str, labels: dict = None, amount: float = 1):
+        key = (name, cls.label_key(labels))
+        with cls.lock:
+            cls.counters[key] = cls.counters.get(key, 0) + amount
+
+    """Add an observation (eg. seconds taken) to a histogram"""
+    @classmethod
+    def observe(cls, name: str, value: float, labels: dict = None):
+        key = (name, cls.label_key(labels))
+        with cls.lock:
+            histogram = cls.histograms.get(key)
+            if histogram is None:
+                histogram = {'buckets': [0] * len(cls.BUCKETS), 'count': 0, 'sum': 0.0}
+                cls.histograms[key] = histogram
+
+            index = bisect.bisect_left(cls.BUCKETS, value)
+            if index < len(cls.BUCKETS):
+                histogram['buckets'][index] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+
+    """Context manager that observes the time taken by its block (even if it raises)"""
+    @classmethod
+    @contextmanager
+    def timer(cls, name: str, labels: dict = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.observe(name, time.perf_counter() - start, labels)
+
+    @staticmethod
+    def label_key(labels: dict):
+        return () if labels is None else tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.counters = {}
+            cls.histograms = {}
+
+    """Every metric in the Prometheus text exposition format"""
+    @classmethod
+    def render(cls):
+        with cls.lock:
+            counters = dict(cls.counters)
+            histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in cls.histograms.items()}
+
+        lines = []
+        for name in sorted(set(key[0] for key in counters)):
+            cls.add_header(lines, name, "counter")
+            for (_, labels), value in sorted(item for item in counters.items() if item[0][0] == name):
+                lines.append(f"{cls.PREFIX}{name}{cls.format_labels(labels)} {cls.format_value(value)}")
+
+        for name in sorted(set(key[0] for key in histograms)):
+            cls.add_header(lines, name, "histogram")
+            for (_, labels), histogram in sorted(((key, value) for key, value in histograms.items() if key[0] == name), key=lambda item: item[0]):
+                cumulative = 0
+                for bound, count in zip(cls.BUCKETS, histogram['buckets']):
+                    cumulative += count
+                    lines.append(f"{cls.PREFIX}{name}_bucket{cls.format_labels(labels + (('le', cls.format_value(bound)),))} {cumulative}")
+                lines.append(f"{cls.PREFIX}{name}_bucket{cls.format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{cls.PREFIX}{name}_sum{cls.format_labels(labels)} {cls.format_value(histogram['sum'])}")
+                lines.append(f"{cls.PREFIX}{name}_count{cls.format_labels(labels)} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def add_header(cls, lines: list, name: str, metric_type: str):
+        lines.append(f"# HELP {cls.PREFIX}{name} {cls.DESCRIPTIONS.get(name, name)}")
+        lines.append(f"# TYPE {cls.PREFIX}{name} {metric_type}")
+
+    @staticmethod
+    def format_labels(labels: tuple):
+        if len(labels) == 0:
+            return ""
+
+        escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+        return "{" + ",".join(f"{key}=\"{value}\"" for (key, _), value in zip(labels, escaped)) + "}"
+
+    @staticmethod
+    def format_value(value: float):
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+    """Write every metric to a file (eg. for the node exporter's textfile collector)"""
+    @classmethod
+    def write(cls, file: str):
+        with open(file + ".tmp", "w") as f:
+            f.write(cls.render())
+        os.replace(file + ".tmp", file)
+        logging.info(f"Metrics written to {file}")
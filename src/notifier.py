@@ -0,0 +1,109 @@
+import logging
+
+from src.history import History
+from src.analysis import Analysis
+from src.coinbase import Currency
+from src.candles import Candles
+from src.slack import Slack
+from src.stats import HourData
+from src.constants import SlackImages
+
+"""Settings for one alert, equivalent to the command line arguments of webhook-notifier.py"""
+class AlertConfig:
+    def __init__(self, url: str, currency: Currency, channel: str = "", name: str = "Cryptocorn", ema: int = 26, interval: int = 60,
+                 threshold_ema: float = 2.5, threshold_reset: float = 1.25, script_name: str = "default"):
+        if len(script_name) < 1:
+            raise ValueError("Script name must be at least 1 character long")
+
+        self.url = url
+        self.currency = currency
+        self.channel = channel
+        self.name = name
+        self.ema = ema
+        self.interval = interval
+        self.threshold_ema = threshold_ema
+        self.threshold_reset = threshold_reset
+        self.script_name = script_name
+
+    @property
+    def data_file(self):
+        return f"last_post_data_{self.script_name}.json"
+
+    """Create from a dictionary (eg. loaded from json), with the pair given as a string such as BTC-USD"""
+    @classmethod
+    def from_dict(cls, data: dict):
+        data = dict(data)
+        crypto, fiat = data.pop('pair', "BTC-USD").split("-")
+        return cls(currency=Currency(crypto, fiat), **data)
+
+class Notifier:
+    # Outbox that posts are queued in (None posts straight to slack)
+    OUTBOX = None
+
+    # Store that the history of every script is saved in (None uses a json file per script)
+    STATE_STORE = None
+
+    # Candle store used for the 28 day price in posts (None requests it from coinbase)
+    CANDLE_STORE = None
+
+    """Run the checks for an alert against the hourly candles (newest first), and post to slack if needed
+    The EMA is saved in the history, so the next run only has to advance it
+    Returns whether a message was posted"""
+    @staticmethod
+    def evaluate(config: AlertConfig, candles: Candles, history: History = None):
+        # Get history from last runs, use it to work out what test to make
+        if history is None:
+            history = Notifier.load_history(config)
+
+        # Get stats from coinbase data
+        # If change isn't large enough, then update history and exit
+        stats = HourData.from_candles(candles, config.ema, last_ema=history.last_ema)
+        history.last_ema = stats.ema_state
+
+        return Notifier.evaluate_stats(config, history, stats, candles.open)
+
+    """Load the history of an alert from the state store, or its json file if there isn't a store"""
+    @staticmethod
+    def load_history(config: AlertConfig, data: dict = None):
+        if Notifier.STATE_STORE is None:
+            return History(config.data_file)
+        return History.from_store(Notifier.STATE_STORE, config.script_name, config.currency.pair, config.data_file, data)
+
+    """Load the history of many alerts, with one query if there is a state store"""
+    @staticmethod
+    def load_histories(configs: list):
+        if Notifier.STATE_STORE is None:
+            return [History(config.data_file) for config in configs]
+
+        data = Notifier.STATE_STORE.load_all(config.script_name for config in configs)
+        return [Notifier.load_history(config, data.get(config.script_name, {})) for config in configs]
+
+    """Run the checks for an alert with stats that have already been calculated, and post to slack if needed
+    The history is saved if it has changed. Returns whether a message was posted"""
+    @staticmethod
+    def evaluate_stats(config: AlertConfig, history: History, stats: HourData, prices: list):
+        if Analysis.ema_checks(stats, history, config.threshold_ema, config.threshold_reset) or \
+                not Analysis.should_post(history, stats, prices, config.threshold_ema):
+            history.save()
+            return False
+
+        logging.info("Message should be posted, generating attachment")
+        attachments = Slack.generate_post(prices, stats, config.currency, Notifier.CANDLE_STORE)
+        image_url = SlackImages.get_image(stats.is_diff_positive)
+
+        # Queued posts are kept until they're sent, so the history can be updated straight away
+        # Newer posts for the same pair and channel replace queued ones that haven't been sent yet
+        if Notifier.OUTBOX is not None:
+            logging.info("Queueing post to slack")
+            Notifier.OUTBOX.enqueue(config.url, Slack.create_post_data(config.name, image_url, "", attachments, config.channel),
+                                    f"{config.channel}:{config.currency.pair}")
+        else:
+            logging.info("Posting to slack")
+            if Slack.post_to_slack(config.name, image_url, "", attachments, config.url, config.channel) == -1:
+                history.save()
+                return False
+
+        history.record_post(stats.cur_price, stats.is_diff_positive, stats.ema)
+        history.save()
+
+        return True
@@ -0,0 +1,166 @@
+import logging
+import json
+import random
+import threading
+import time
+
+from src.database import Database
+from src.http_client import HttpClient
+from src.metrics import Metrics
+
+"""Durable queue of messages to post to slack webhooks, stored in SQLite so that it can be shared by processes and survives restarts
+Messages are retried with exponential backoff (with jitter) until they're posted, and posts to each webhook are rate limited
+Queueing a message with the same coalesce key as a message that hasn't been sent yet replaces it, so only the newest is posted"""
+class Outbox:
+    # Seconds a message is claimed for while it's being sent, so other processes flushing the same outbox don't send it too
+    CLAIM_SECONDS = 60
+
+    def __init__(self, file: str = "slack_outbox.db", max_attempts: int = 10, base_backoff: float = 5.0, max_backoff: float = 900.0,
+                 webhook_interval: float = 1.0):
+        self.file = file
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.webhook_interval = webhook_interval
+
+        self.sender = None
+        self.wake = threading.Event()
+
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, coalesce_key TEXT, "
+                       "payload TEXT NOT NULL, created REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, "
+                       "claimed REAL NOT NULL DEFAULT 0, last_error TEXT)")
+            db.execute("CREATE INDEX IF NOT EXISTS messages_due ON messages (next_attempt)")
+            db.execute("CREATE TABLE IF NOT EXISTS webhooks (url TEXT PRIMARY KEY, next_post REAL NOT NULL)")
+
+    """New connection, each call uses its own so that the outbox can be used from any thread"""
+    def connect(self):
+        return Database.connect(self.file)
+
+    """Queue a message to be posted to the webhook url, replacing any unsent message with the same coalesce key"""
+    def enqueue(self, url: str, payload: dict, coalesce_key: str = None):
+        now = time.time()
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            if coalesce_key is not None:
+                # Messages that are being sent (claimed) can't be replaced
+                replaced = db.execute("DELETE FROM messages WHERE url = ? AND coalesce_key = ? AND claimed <= ?",
+                                      (url, coalesce_key, now)).rowcount
+                if replaced > 0:
+                    logging.info(f"Replaced {replaced} unsent messages for {coalesce_key} with a newer one")
+                    Metrics.increment("slack_outbox_coalesced_total", amount=replaced)
+
+            db.execute("INSERT INTO messages (url, coalesce_key, payload, created, next_attempt) VALUES (?, ?, ?, ?, ?)",
+                       (url, coalesce_key, json.dumps(payload), now, now))
+            db.execute("COMMIT")
+
+        Metrics.increment("slack_outbox_enqueued_total")
+        self.wake.set()
+
+    """Number of messages waiting to be posted"""
+    def pending(self):
+        with self.connect() as db:
+            return db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    """Post every message that is due, returns the number posted
+    Messages are only sent until the deadline (unix time) if one is given, and messages that fail stay queued for the next flush"""
+    def flush(self, deadline: float = None):
+        sent = 0
+        while deadline is None or time.time() < deadline:
+            message = self.claim()
+            if message is not None:
+                if self.send(*message):
+                    sent += 1
+                continue
+
+            # Wait for rate limited webhooks and retries if they're due before the deadline
+            wait = self.next_due()
+            if deadline is None or wait is None or time.time() + wait >= deadline:
+                break
+            time.sleep(wait)
+
+        return sent
+
+    """Claim the oldest message that is due and whose webhook isn't rate limited, returns (id, url, payload, attempts) or None"""
+    def claim(self):
+        now = time.time()
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT id, url, payload, attempts FROM messages "
+                             "WHERE next_attempt <= ? AND claimed <= ? AND url NOT IN (SELECT url FROM webhooks WHERE next_post > ?) "
+                             "ORDER BY id LIMIT 1", (now, now, now)).fetchone()
+            if row is not None:
+                db.execute("UPDATE messages SET claimed = ? WHERE id = ?", (now + self.CLAIM_SECONDS, row[0]))
+                db.execute("INSERT OR REPLACE INTO webhooks (url, next_post) VALUES (?, ?)", (row[1], now + self.webhook_interval))
+            db.execute("COMMIT")
+
+        return row
+
+    """Post a claimed message, removing it if it was posted and scheduling a retry if it wasn't. Returns whether it was posted"""
+    def send(self, message_id: int, url: str, payload: str, attempts: int):
+        retry_after = None
+        # noinspection PyBroadException
+        try:
+            with Metrics.timer("slack_post_seconds", {'kind': "webhook"}):
+                response = HttpClient.post(url, data=payload, headers={"content-type": "application/json"})
+            Metrics.increment("slack_posts_total", {'kind': "webhook", 'result': response.status_code})
+
+            if response.status_code == 200:
+                with self.connect() as db:
+                    db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+                logging.info(f"Posted message {message_id} to slack")
+                return True
+
+            error = f"Response code was {response.status_code} ({response.text[:200]})"
+            if response.status_code == 429 and response.headers.get("Retry-After", "").isdigit():
+                retry_after = float(response.headers["Retry-After"])
+        except Exception as e:
+            Metrics.increment("slack_posts_total", {'kind': "webhook", 'result': "error"})
+            error = f"{type(e).__name__}: {e}"
+
+        self.retry(message_id, url, attempts + 1, error, retry_after)
+        return False
+
+    def retry(self, message_id: int, url: str, attempts: int, error: str, retry_after: float = None):
+        with self.connect() as db:
+            if attempts >= self.max_attempts:
+                db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+                logging.error(f"Giving up posting message {message_id} to slack after {attempts} attempts ({error})")
+                Metrics.increment("slack_outbox_dropped_total")
+                return
+
+            wait = retry_after if retry_after is not None else random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1)))
+            db.execute("UPDATE messages SET attempts = ?, next_attempt = ?, claimed = 0, last_error = ? WHERE id = ?",
+                       (attempts, time.time() + wait, error, message_id))
+            if retry_after is not None:
+                db.execute("UPDATE webhooks SET next_post = ? WHERE url = ?", (time.time() + retry_after, url))
+
+        logging.warning(f"Couldn't post message {message_id} to slack ({error}), retrying in {wait:.1f} seconds (attempt {attempts})")
+
+    """Seconds until a message can next be sent, taking retries, claims and webhook rate limits into account (None if the outbox is empty)"""
+    def next_due(self):
+        with self.connect() as db:
+            next_attempt = db.execute("SELECT MIN(MAX(m.next_attempt, m.claimed, COALESCE(w.next_post, 0))) FROM messages m "
+                                      "LEFT JOIN webhooks w ON w.url = m.url").fetchone()[0]
+        return None if next_attempt is None else max(0.0, next_attempt - time.time())
+
+    """Start a background thread that posts messages as they're queued and retries failed ones"""
+    def start_sender(self, poll_interval: float = 5.0):
+        if self.sender is not None:
+            return
+
+        def run():
+            while True:
+                # noinspection PyBroadException
+                try:
+                    self.flush()
+                    wait = self.next_due()
+                except Exception:
+                    logging.exception("Exception occurred sending slack messages", exc_info=True)
+                    wait = None
+
+                self.wake.wait(poll_interval if wait is None else min(max(wait, 0.1), poll_interval))
+                self.wake.clear()
+
+        self.sender = threading.Thread(target=run, name="outbox", daemon=True)
+        self.sender.start()
@@ -0,0 +1,101 @@
+import logging
+import json
+import os
+import threading
+import time
+
+from src.coinbase import Coinbase
+from src.http_client import HttpClient
+from src.metrics import Metrics
+
+"""Currency pairs that coinbase currently trades, from its products endpoint
+The list is cached in memory and on disk, and only requested again after the refresh interval
+If it can't be retrieved (and there is no cached copy) then every pair is treated as supported
+Thread safe, the lookup that finds the list out of date refreshes it while other lookups keep using the old list"""
+class ProductCatalog:
+    def __init__(self, file: str = "products.json", refresh_interval: float = 86400):
+        self.file = file
+        self.refresh_interval = refresh_interval
+
+        self.pairs = None
+        self.retrieved = 0.0
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    """Whether coinbase trades the pair (eg. BTC-GBP), True if that is unknown"""
+    def is_supported(self, pair: str):
+        pairs = self.get_pairs()
+        return pairs is None or pair in pairs
+
+    """Set of tradable pairs, or None if it couldn't be retrieved"""
+    def get_pairs(self):
+        with self.lock:
+            if self.pairs is None:
+                self.load()
+
+            # Only one thread requests the products, and the lock isn't held while it does
+            refresh = not self.refreshing and time.time() - self.retrieved > self.refresh_interval
+            if not refresh:
+                return self.pairs
+            self.refreshing = True
+
+        try:
+            self.refresh()
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+        return self.pairs
+
+    def load(self):
+        try:
+            with open(self.file, "r") as f:
+                data = json.loads(f.read())
+            self.pairs = set(data['pairs'])
+            self.retrieved = data['retrieved']
+            logging.debug(f"Loaded {len(self.pairs)} products from {self.file}")
+        except (IOError, ValueError, KeyError, TypeError):
+            logging.info(f"Couldn't load product catalog {self.file}")
+
+    """Request the products from coinbase, keeping the old list if the request fails. Must be called without the lock held"""
+    def refresh(self):
+        logging.info("Retrieving products from coinbase")
+        try:
+            Coinbase.RATE_LIMITER.acquire()
+            with Metrics.timer("coinbase_request_seconds", {'endpoint': "products"}):
+                resp = HttpClient.get(f"{Coinbase.API_URL}/products")
+            Metrics.increment("coinbase_requests_total", {'endpoint': "products", 'code': resp.status_code})
+            if resp.status_code != 200:
+                raise IOError(f"Code not 200 (received {resp.status_code})")
+
+            products = json.loads(resp.text)
+            pairs = set(product['id'] for product in products
+                        if not product.get('trading_disabled', False) and product.get('status', "online") == "online")
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Couldn't retrieve products from coinbase ({e}), " +
+                            ("using the cached list" if self.pairs is not None else "treating every pair as supported"))
+            # Don't try again on every lookup while coinbase is unavailable
+            with self.lock:
+                self.retrieved = time.time() - self.refresh_interval + min(self.refresh_interval, 60)
+            return
+
+        with self.lock:
+            self.pairs = pairs
+            self.retrieved = time.time()
+        logging.info(f"Coinbase trades {len(pairs)} products")
+        self.save()
+
+    def save(self):
+        try:
+            self.write()
+        except IOError as e:
+            logging.warning(f"Couldn't save product catalog to {self.file} ({e})")
+
+    def write(self):
+        directory = os.path.dirname(self.file)
+        if directory != "" and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.file + ".tmp", "w") as f:
+            json.dump({'retrieved': self.retrieved, 'pairs': sorted(self.pairs)}, f)
+        os.replace(self.file + ".tmp", self.file)
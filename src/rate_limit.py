@@ -0,0 +1,127 @@
+import logging
+import json
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+"""Token bucket rate limiter, with exponential backoff (with jitter) for when the API rate limits us anyway
+Thread safe, and if a state file is given then the bucket is shared with other processes using the same file (requires fcntl)"""
+class RateLimiter:
+    def __init__(self, rate: float = 8.0, burst: int = 10, max_retries: int = 8, base_backoff: float = 0.5, max_backoff: float = 30.0,
+                 state_file: str = None):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        if state_file is not None and fcntl is None:
+            logging.warning("fcntl is not available, so the rate limit can't be shared with other processes")
+            state_file = None
+        self.state_file = state_file
+
+        self.lock = threading.Lock()
+        self.tokens = float(burst)
+        self.updated = time.time()
+
+        # Metrics
+        self.requests = 0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.rate_limited = 0
+        self.backoff_seconds = 0.0
+
+    """Block until a request can be made"""
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                wait = self.take_token()
+                if wait == 0:
+                    self.requests += 1
+                    if waited > 0:
+                        self.throttled += 1
+                        self.throttled_seconds += waited
+                    return waited
+
+            time.sleep(wait)
+            waited += wait
+
+    """Called after a rate limited response, empties the bucket (for every thread/process) and sleeps for the backoff
+    Raises IOError once the retry cap is reached, otherwise returns the seconds slept"""
+    def backoff(self, attempt: int):
+        with self.lock:
+            self.rate_limited += 1
+            self.update_state(lambda tokens: min(tokens, 0.0))
+
+        if attempt > self.max_retries:
+            raise IOError(f"Still rate limited after {self.max_retries} retries")
+
+        # Full jitter, so that clients rate limited at the same time don't retry in lockstep
+        wait = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+        time.sleep(wait)
+
+        with self.lock:
+            self.backoff_seconds += wait
+        return wait
+
+    """Take a token if there is one, otherwise return the seconds until one will be available"""
+    def take_token(self):
+        wait = 0.0
+
+        def take(tokens):
+            nonlocal wait
+            if tokens >= 1:
+                return tokens - 1
+            wait = (1 - tokens) / self.rate
+            return tokens
+
+        self.update_state(take)
+        return wait
+
+    """Refill the bucket and apply the function given to the number of tokens
+    Must be called with the lock held"""
+    def update_state(self, func):
+        if self.state_file is None:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens = func(self.tokens)
+            return
+
+        with open(self.state_file, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                state = json.loads(f.read() or "{}")
+                now = time.time()
+                tokens = state.get('tokens', float(self.burst))
+                tokens = min(self.burst, tokens + (now - state.get('updated', now)) * self.rate)
+                tokens = func(tokens)
+
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({'tokens': tokens, 'updated': now}))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'throttled_seconds': self.throttled_seconds,
+                'rate_limited': self.rate_limited,
+                'backoff_seconds': self.backoff_seconds
+            }
+
+    def log_stats(self, name: str):
+        stats = self.stats()
+        logging.info(f"{name} rate limiter: {stats['requests']} requests, {stats['throttled']} throttled for {stats['throttled_seconds']:.2f}s, "
+                     f"{stats['rate_limited']} rate limited responses with {stats['backoff_seconds']:.2f}s of backoff")
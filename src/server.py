@@ -5,16 +5,45 @@ from http.server import BaseHTTPRequestHandler, HTTPServer
 import urllib.parse as urlparse
 import hashlib
 import hmac
-import threading
 
+from src.admission import NonceCache
 from src.coinbase import Currencies
+from src.metrics import Metrics
 from src.server_processor import ServerProcessor, ParseError
+from src.worker_pool import WorkerPool
 
 """Override methods of HTTPServer to improve logging"""
 class CustomHTTPServer(HTTPServer):
     def handle_error(self, request, client_address):
         logging.exception(f"Exception happened during processing of request from {client_address}", exc_info=True)
 
+"""Handles each connection on a fixed size pool of threads, so one slow client doesn't block the others
+Connections are rejected with a 503 if the pool's queue is full"""
+class PooledHTTPServer(CustomHTTPServer):
+    def __init__(self, server_address, handler_class, pool: WorkerPool):
+        super().__init__(server_address, handler_class)
+        self.pool = pool
+
+    def process_request(self, request, client_address):
+        if self.pool.submit(self.process_request_thread, request, client_address):
+            return
+
+        logging.warning(f"Rejecting connection from {client_address}, server is too busy")
+        try:
+            request.sendall(b"HTTP/1.0 503 Service Unavailable\r\n\r\n")
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    """Adapted from socketserver.ThreadingMixIn"""
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
 class CommandHandler(BaseHTTPRequestHandler):
     # Seconds to allow for timestamp mismatch
     # SHA-256 should be secure enough to set it to 5 minutes (value given in docs)
@@ -23,9 +52,31 @@ class CommandHandler(BaseHTTPRequestHandler):
     # Maximum days to be allowed to retrieve
     MAX_DAYS = 10
 
+    # Seconds before the connection of a slow client is dropped
+    timeout = 10
+
     VERSION = "v0"
     SIGNING_SECRET = ""
 
+    # Pool that ServerProcessor.post_200_code jobs are run on (set by run)
+    WORKER_POOL = None
+
+    # Pairs that coinbase trades, used to reject unsupported pairs before any prices are requested (None allows every pair)
+    PRODUCT_CATALOG = None
+
+    # Slash command bodies are small, so anything larger than this is rejected before it's read
+    MAX_BODY_BYTES = 8192
+    READ_CHUNK_BYTES = 4096
+
+    # Signatures of commands already received (set by run)
+    NONCE_CACHE = None
+
+    # Token buckets limiting how often each user and channel can request prices, and the limit on commands being processed at once
+    # (None doesn't limit them)
+    USER_BUCKETS = None
+    CHANNEL_BUCKETS = None
+    IN_FLIGHT = None
+
     SIG_STRING = "X-Slack-Signature"
     REQ_TS = "X-Slack-Request-Timestamp"
     CONTENT_TYPE = "application/x-www-form-urlencoded"
@@ -37,42 +88,95 @@ class CommandHandler(BaseHTTPRequestHandler):
         REQ_TS: None
     }
 
+    # GET is only used for metrics
+    # noinspection PyPep8Naming
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = Metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     # POST is for submitting data.
     # noinspection PyPep8Naming
     def do_POST(self):
+        received = time.perf_counter()
+        outcome = "error"
+        try:
+            outcome = self.handle_command(received)
+        finally:
+            Metrics.increment("slash_requests_total", {'outcome': outcome})
+            Metrics.observe("slash_request_seconds", time.perf_counter() - received)
+
+    """Respond to a slash command, returns the outcome for metrics"""
+    def handle_command(self, received: float):
         logging.info(f"Incoming HTTP POST: {self.path}")
 
         if self.path != "/slack/crypto":
             logging.info("Path not /slack/crypto")
             self.send_error(400)
-            return
+            return "bad_path"
 
         if not self.basic_header_verification():
             self.send_error(400)
-            return
+            return "bad_headers"
 
-        # Get and parse body data
-        content_length = int(self.headers.get('Content-Length', 0))
-        body_data = self.rfile.read(content_length).decode("utf-8")
-        body_dict = urlparse.parse_qs(body_data)
-
-        response_url = body_dict['response_url'][0]
-        username = body_dict['user_name'][0]
+        # Check the length of the body before reading any of it
+        try:
+            content_length = int(self.headers.get('Content-Length', ""))
+        except ValueError:
+            content_length = -1
+        if content_length < 0 or content_length > self.MAX_BODY_BYTES:
+            logging.info(f"Content length was {self.headers.get('Content-Length')}, must be at most {self.MAX_BODY_BYTES} bytes")
+            self.send_error(413 if content_length > self.MAX_BODY_BYTES else 411)
+            return "bad_length"
+
+        # Read the body and verify the signature before doing anything with it
+        with Metrics.timer("slash_signature_seconds"):
+            body_data = self.read_signed_body(content_length)
+        if body_data is None:
+            self.send_error(401)
+            return "bad_signature"
 
-        # Verify signature
-        if not self.verify_signature(body_data):
+        if self.NONCE_CACHE is not None and not self.NONCE_CACHE.add(int(self.headers[self.REQ_TS]), self.headers[self.SIG_STRING]):
+            logging.warning("Request has already been received, ignoring the replay")
             self.send_error(401)
-            return
+            return "replayed"
+
+        # Parse body data
+        try:
+            body_dict = urlparse.parse_qs(body_data.decode("utf-8"), strict_parsing=True)
+            response_url = body_dict['response_url'][0]
+            username = body_dict['user_name'][0]
+        except (UnicodeDecodeError, ValueError, KeyError) as e:
+            logging.warning(f"Couldn't parse body ({type(e).__name__}: {e})")
+            self.send_error(400)
+            return "bad_body"
 
         # Log request
-        logging.debug("Request info:")
-        logging.debug("Username: " + body_dict['user_name'][0])
-        logging.debug("Channel: " + body_dict['channel_name'][0] + " (" + body_dict['channel_id'][0] + ")")
-        logging.debug("Command: " + body_dict['command'][0] + " " + body_dict.get('text', [''])[0])
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Request info:")
+            logging.debug("Username: " + body_dict['user_name'][0])
+            logging.debug("Channel: " + body_dict['channel_name'][0] + " (" + body_dict['channel_id'][0] + ")")
+            logging.debug("Command: " + body_dict['command'][0] + " " + body_dict.get('text', [''])[0])
 
         # Process help message instead
         if self.help_message(body_dict):
-            return
+            return "help"
+
+        # Limit how often each user and channel can request prices
+        user_id = body_dict.get('user_id', [username])[0]
+        channel_id = body_dict.get('channel_id', [""])[0]
+        if (self.USER_BUCKETS is not None and not self.USER_BUCKETS.take(user_id)) or \
+                (self.CHANNEL_BUCKETS is not None and not self.CHANNEL_BUCKETS.take(channel_id)):
+            logging.info(f"Rate limiting {username} ({user_id}) in {channel_id}")
+            self.initial_response("Prices are being requested too often, please wait a minute and try again")
+            return "rate_limited"
 
         # Parse args
         try:
@@ -81,29 +185,55 @@ class CommandHandler(BaseHTTPRequestHandler):
             logging.warning(f"Parse error: {e}")
             self.initial_response(f"Parse error: {e}"
                                   f"\nUse `/prices help` for help")
-            return
+            return "parse_error"
 
         # Don't allow more than 20 days to be retrieved
         if len(days) > self.MAX_DAYS:
             logging.info(f"Number of days was greater than {self.MAX_DAYS}")
             self.initial_response(f"Max number of days to request is {self.MAX_DAYS}")
-            return
-
-        # Send 200
-        # Temporary code to notify about GBP support (TODO remove after a month)
-        logging.info("Sending initial 200 response")
-        resp = []
-        if len(days) > 2:
-            resp.append(f"Retrieving data for {len(days)} days, this may take a few seconds")
-        if currency.fiat == "GBP" and currency.crypto != "BTC":
-            resp.append("The GBP currency has only just been added for certain trading pairs, manually reduce the days to retrieve (otherwise this command will fail)")
-        self.initial_response('\n'.join(resp))
-
-        # Process request on separate thread to not block 200 response
-        logging.debug("Starting the separate thread to handle the rest of the processing")
-        t = threading.Thread(target=ServerProcessor.post_200_code, args=(response_url, username, currency, days))
-        t.daemon = True
-        t.start()
+            return "too_many_days"
+
+        # Don't request prices for pairs that coinbase doesn't trade
+        if self.PRODUCT_CATALOG is not None and not self.PRODUCT_CATALOG.is_supported(currency.pair):
+            logging.info(f"{currency.pair} is not traded on coinbase")
+            self.initial_response(f"{currency.crypto_long} ({currency.crypto}) is not traded in {currency.fiat} on coinbase")
+            return "unsupported_pair"
+
+        # Commands are turned away straight away if too many are being processed, rather than queueing more requests to coinbase
+        if self.IN_FLIGHT is not None and not self.IN_FLIGHT.acquire():
+            self.initial_response("Too many price requests are being processed right now, please try again in a moment")
+            return "busy"
+
+        # The slot is released by process_command once the command is queued, so it must be released here if anything fails first
+        # (eg. the client has disconnected and sending the 200 raises)
+        submitted = False
+        try:
+            # Send 200 before the command is queued, so slack has the response before a worker can post the report
+            logging.info("Sending initial 200 response")
+            if len(days) > 2:
+                self.initial_response(f"Retrieving data for {len(days)} days, this may take a few seconds")
+            else:
+                self.initial_response("")
+
+            # Process request on a worker thread to not block 200 response
+            # If the queue is full the 200 has already been sent, so the command is turned away through the response url instead
+            logging.debug("Queueing the rest of the processing on the worker pool")
+            submitted = self.WORKER_POOL.submit(self.process_command, response_url, username, currency, days, received)
+        finally:
+            if not submitted and self.IN_FLIGHT is not None:
+                self.IN_FLIGHT.release()
+
+        if not submitted:
+            # noinspection PyBroadException
+            try:
+                ServerProcessor.send_response_msg(response_url, {
+                    "text": "Too many price requests are being processed right now, please try again in a moment"
+                })
+            except Exception:
+                logging.exception("Couldn't tell the user that the command was turned away", exc_info=True)
+            return "busy"
+
+        return "accepted"
 
     def help_message(self, body_dict: dict):
         text = body_dict.get("text", [""])[0].lower()
@@ -116,6 +246,13 @@ class CommandHandler(BaseHTTPRequestHandler):
                      "\n\nSupported cryptocurrencies: " + ', '.join(sorted(Currencies.CRYPTO_MAP.keys())) + \
                      "\nSupported fiat currencies: " + ', '.join(sorted(Currencies.FIAT_MAP.keys()))
 
+        # Not every pair of the currencies above is traded
+        pairs = None if self.PRODUCT_CATALOG is None else self.PRODUCT_CATALOG.get_pairs()
+        if pairs is not None:
+            supported_pairs = sorted(f"{crypto}-{fiat}" for crypto in Currencies.CRYPTO_MAP for fiat in Currencies.FIAT_MAP
+                                     if f"{crypto}-{fiat}" in pairs)
+            return_msg += "\nSupported pairs: " + ', '.join(supported_pairs)
+
         self.initial_response(return_msg)
         return True
 
@@ -138,34 +275,55 @@ class CommandHandler(BaseHTTPRequestHandler):
 
         return True
 
-    """Verify that message was given by slack
+    """Read the body (at most content_length bytes) and verify that the message was given by slack, returns the body or None if it wasn't
+    The signature is computed as the body is read, so nothing is done with the body until it's verified
     https://api.slack.com/docs/verifying-requests-from-slack"""
-    def verify_signature(self, body: str):
+    def read_signed_body(self, content_length: int):
         logging.info("Verifying signature")
 
         # Read headers
         given_sig = self.headers[self.SIG_STRING]
         timestamp = self.headers[self.REQ_TS]
 
-        # Ensure timestamp isn't too old
+        # Ensure timestamp isn't too old (or in the future)
+        if not timestamp.isdigit():
+            logging.info(f"Timestamp \"{timestamp}\" is not a unix time")
+            return None
         unix_now = time.time()
         time_diff = unix_now - int(timestamp)
-        if time_diff > self.REPLAY_PREVENTION:
+        if abs(time_diff) > self.REPLAY_PREVENTION:
             logging.info(f"Time difference was too large ({time_diff:,.0f} seconds)")
-            return False
+            return None
 
         # Compute signature
-        sig_basestring = self.VERSION + ":" + timestamp + ":" + body
-        digest = hmac.new(str.encode(self.SIGNING_SECRET), sig_basestring.encode("utf-8"), digestmod=hashlib.sha256)
+        digest = hmac.new(str.encode(self.SIGNING_SECRET), f"{self.VERSION}:{timestamp}:".encode("utf-8"), digestmod=hashlib.sha256)
+        body = bytearray()
+        while len(body) < content_length:
+            chunk = self.rfile.read(min(self.READ_CHUNK_BYTES, content_length - len(body)))
+            if not chunk:
+                logging.info(f"Connection closed after {len(body)}/{content_length} bytes of the body")
+                return None
+            digest.update(chunk)
+            body += chunk
         computed_sig = self.VERSION + "=" + digest.hexdigest()
 
         # Compare
         if hmac.compare_digest(computed_sig, given_sig):
-            return True
+            return bytes(body)
         else:
             logging.info("Signatures don't match")
             logging.info(f"Given: {given_sig}")
             logging.info(f"Expected: {computed_sig}")
+            return None
+
+    """Run on a worker thread, allows another command to be processed once it's done"""
+    @classmethod
+    def process_command(cls, url, user, currency, days, received: float):
+        try:
+            ServerProcessor.post_200_code(url, user, currency, days, received)
+        finally:
+            if cls.IN_FLIGHT is not None:
+                cls.IN_FLIGHT.release()
 
     """Send 200 message back"""
     def initial_response(self, message: str = None):
@@ -180,8 +338,12 @@ class CommandHandler(BaseHTTPRequestHandler):
     def log_message(self, format_, *args):
         pass
 
-    @staticmethod
-    def run(port):
-        server = CustomHTTPServer(('', port), CommandHandler)
+    """Run the server, connections and the processing of commands are each handled by a separate bounded pool of threads"""
+    @classmethod
+    def run(cls, port, server_threads: int = 8, server_queue_size: int = 32, workers: int = 4, worker_queue_size: int = 16):
+        cls.WORKER_POOL = WorkerPool("worker", workers, worker_queue_size)
+        if cls.NONCE_CACHE is None:
+            cls.NONCE_CACHE = NonceCache(cls.REPLAY_PREVENTION)
+        server = PooledHTTPServer(('', port), cls, WorkerPool("http", server_threads, server_queue_size))
         logging.info(f"Web server started on port {port}")
         server.serve_forever()
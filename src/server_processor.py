@@ -1,10 +1,12 @@
 import logging
 import shlex
+import time
 from datetime import datetime, timedelta
-import requests
 import json
 
 from src.coinbase import Currencies, Currency, Coinbase
+from src.http_client import HttpClient
+from src.metrics import Metrics
 from src.slack import Slack
 
 
@@ -13,6 +15,20 @@ class ParseError(Exception):
 
 """Static methods for server.py"""
 class ServerProcessor:
+    # Coarsest candle granularity (seconds) used for prices in the last 24 hours, and for day prices
+    # Day prices use 5 minute candles so they're within a few minutes of the time asked for, a request still covers about a day of them
+    RECENT_GRANULARITY = 60
+    HOUR_24_GRANULARITY = 300
+    DAY_GRANULARITY = 300
+
+    # Post the recent prices as soon as they're retrieved, and replace the message as day prices are retrieved
+    PROGRESSIVE = True
+    # Seconds after the command was received that the prices retrieved so far are posted (the rest are marked as unavailable)
+    RESPONSE_DEADLINE = 20.0
+    # Slack allows 5 posts to a response url, and updates are at least this many seconds apart
+    MAX_RESPONSE_POSTS = 5
+    UPDATE_INTERVAL = 1.0
+
     @staticmethod
     def send_response_msg(url, json_msg, ephemeral=True):
         if ephemeral:
@@ -20,10 +36,22 @@ class ServerProcessor:
         else:
             json_msg['response_type'] = "in_channel"
 
-        requests.post(url, data=json.dumps(json_msg), headers={"content-type": "application/json"})
+        # noinspection PyBroadException
+        try:
+            with Metrics.timer("slack_post_seconds", {'kind': "response_url"}):
+                resp = HttpClient.post(url, data=json.dumps(json_msg), headers={"content-type": "application/json"})
+        except Exception:
+            Metrics.increment("slack_posts_total", {'kind': "response_url", 'result': "error"})
+            raise
+        Metrics.increment("slack_posts_total", {'kind': "response_url", 'result': resp.status_code})
 
     @classmethod
     def parse_args(cls, body_dict: dict):
+        with Metrics.timer("slash_parse_seconds"):
+            return cls.__parse_args(body_dict)
+
+    @classmethod
+    def __parse_args(cls, body_dict: dict):
         # Default values
         logging.info("Parsing args")
         messages = body_dict.get('text', [''])[0]
@@ -70,12 +98,12 @@ class ServerProcessor:
     @staticmethod
     def parse_currency_args_1(message: str):
         # Is arg crypto?
-        crypto = Currencies.get_map_match(Currencies.CRYPTO_MAP, message)
+        crypto = Currencies.get_map_match(Currencies.CRYPTO_INDEX, message)
         if crypto is not None:
             return Currency(crypto, Currencies.FIAT_DEFAULT)
 
         # Is arg fiat?
-        fiat = Currencies.get_map_match(Currencies.FIAT_MAP, message)
+        fiat = Currencies.get_map_match(Currencies.FIAT_INDEX, message)
         if fiat is not None:
             return Currency(Currencies.CRYPTO_DEFAULT, fiat)
 
@@ -84,18 +112,18 @@ class ServerProcessor:
     @staticmethod
     def parse_currency_args_2(message: list):
         # Try crypto being first
-        crypto = Currencies.get_map_match(Currencies.CRYPTO_MAP, message[0])
+        crypto = Currencies.get_map_match(Currencies.CRYPTO_INDEX, message[0])
         if crypto is not None:
-            fiat = Currencies.get_map_match(Currencies.FIAT_MAP, message[1])
+            fiat = Currencies.get_map_match(Currencies.FIAT_INDEX, message[1])
             if fiat is None:
                 raise ParseError(f"Could not interpret '{message[1]}' as a fiat currency ('{message[0]}' was a cryptocurrency)")
 
             return Currency(crypto, fiat)
 
         # Try fiat being first
-        fiat = Currencies.get_map_match(Currencies.FIAT_MAP, message[0])
+        fiat = Currencies.get_map_match(Currencies.FIAT_INDEX, message[0])
         if fiat is not None:
-            crypto = Currencies.get_map_match(Currencies.CRYPTO_MAP, message[1])
+            crypto = Currencies.get_map_match(Currencies.CRYPTO_INDEX, message[1])
             if crypto is None:
                 raise ParseError(f"Could not interpret '{message[1]}' as a cryptocurrency ('{message[0]}' was a fiat currency)")
 
@@ -106,34 +134,59 @@ class ServerProcessor:
     @staticmethod
     def create_slack_attachments(currency: Currency, days: list):
         cb = Coinbase(currency, 1)
-        time_now = datetime.utcnow()
 
-        # Get 0/1/24 hour prices
-        cur_price, price_1_hour = cb.get_prices_closest_to_time(time_now, time_now - timedelta(minutes=60))
-        price_24_hour = cb.price_days_ago(1)
+        # Get 0/1/24 hour prices and day prices in as few requests as possible
+        lookups = ServerProcessor.create_lookups(days, datetime.utcnow())
+        prices = cb.get_prices_at_times(lookups)
 
-        # Get day prices
-        day_prices = {}
-        for day in days:
-            day_prices[day] = cb.price_days_ago(day)
+        return ServerProcessor.format_attachments(currency, days, dict(enumerate(prices)))
+
+    """(time, granularity) lookups for the current, 1 hour and 24 hour prices, followed by the price each day ago"""
+    @staticmethod
+    def create_lookups(days: list, time_now: datetime):
+        lookups = [
+            (time_now, ServerProcessor.RECENT_GRANULARITY),
+            (time_now - timedelta(minutes=60), ServerProcessor.RECENT_GRANULARITY),
+            (time_now - timedelta(days=1), ServerProcessor.HOUR_24_GRANULARITY)
+        ]
+        lookups += [(time_now - timedelta(days=day), ServerProcessor.DAY_GRANULARITY) for day in days]
+        return lookups
+
+    """Attachments from the prices of each lookup (lookup index -> price), the current, 1 hour and 24 hour prices are required
+    Day prices that are missing (or None) are marked as still being retrieved if pending, otherwise as unavailable"""
+    @staticmethod
+    def format_attachments(currency: Currency, days: list, prices: dict, pending: bool = False):
+        cur_price, price_1_hour, price_24_hour = prices[0], prices[1], prices[2]
 
         # Create message
         pretext = f"{currency.crypto_long}'s current price is: {currency.fiat_symbol}{Slack.format_num(cur_price)}"
         attachments = Slack.generate_attachments(currency, {1: price_1_hour, 24: price_24_hour}, cur_price, True)
-        attachments += Slack.generate_attachments(currency, day_prices, cur_price, False)
+        for i, day in enumerate(days, 3):
+            if prices.get(i) is None:
+                attachments.append(Slack.format_missing_entry(day, False, pending))
+            else:
+                attachments.append(Slack.format_price_entry(cur_price, prices[i], currency, day, False))
         attachments[0]['pretext'] = pretext
 
         return attachments
 
-    """Wrapper for starting threading"""
+    """Wrapper for starting threading
+    Received is the time.perf_counter() value when the command was received, used to time the whole command"""
     @classmethod
-    def post_200_code(cls, url, user, currency, days):
+    def post_200_code(cls, url, user, currency, days, received: float = None):
         # noinspection PyBroadException
         try:
-            cls.__post_200_code(url, user, currency, days)
+            if cls.PROGRESSIVE:
+                deadline = (time.perf_counter() if received is None else received) + cls.RESPONSE_DEADLINE
+                cls.__post_progressive(url, user, currency, days, deadline)
+            else:
+                cls.__post_200_code(url, user, currency, days)
         except Exception:
             logging.exception("Exception occurred in thread", exc_info=True)
 
+        if received is not None:
+            Metrics.observe("slash_command_seconds", time.perf_counter() - received)
+
     """Implementation of post_200_code"""
     @staticmethod
     def __post_200_code(url, user, currency, days):
@@ -160,6 +213,62 @@ class ServerProcessor:
         }
         ServerProcessor.send_response_msg(url, json_msg, ephemeral=False)
 
+        ServerProcessor.log_stats()
+
+    """Implementation of post_200_code that posts the current, 1 hour and 24 hour prices as soon as they're retrieved
+    The message is then replaced as day prices are retrieved, and whatever has been retrieved by the deadline (perf_counter value) is posted"""
+    @classmethod
+    def __post_progressive(cls, url, user, currency, days, deadline: float):
+        cb = Coinbase(currency, 1)
+        lookups = cls.create_lookups(days, datetime.utcnow())
+
+        prices = {}
+        posts = 0
+        last_post = 0.0
+        for retrieved in cb.iter_prices_at_times(lookups, max(0.0, deadline - time.perf_counter())):
+            prices.update(retrieved)
+            if len(prices) == len(lookups) or any(prices.get(i, 0.0) is None for i in range(3)):
+                break
+            if any(i not in prices for i in range(3)):
+                continue
+
+            # Slack only allows a few posts to each response url, so updates are limited and the last post is saved for the final message
+            if posts == 0 or (posts < cls.MAX_RESPONSE_POSTS - 1 and time.perf_counter() - last_post >= cls.UPDATE_INTERVAL):
+                logging.info(f"Posting {len(prices)}/{len(lookups)} prices to slack")
+                cls.send_report(url, user, cls.format_attachments(currency, days, prices, True), posts > 0)
+                posts += 1
+                last_post = time.perf_counter()
+
+        # The day prices are relative to the current price, so nothing can be posted without the recent prices
+        if any(prices.get(i) is None for i in range(3)):
+            ServerProcessor.send_response_msg(url, {
+                "text": "Error querying coinbase, please try again later"
+            })
+            return
+
+        missing = len(lookups) - sum(1 for price in prices.values() if price is not None)
+        logging.info(f"Posting to slack ({missing} prices missing)" if missing > 0 else "Posting to slack")
+        cls.send_report(url, user, cls.format_attachments(currency, days, prices, False), posts > 0)
+
+        cls.log_stats()
+
+    """Post the price report to the channel, replacing the report posted before if replace is set"""
+    @staticmethod
+    def send_report(url, user, attachments: list, replace: bool = False):
+        json_msg = {
+            "text": f"{user} requested a price report",
+            "attachments": attachments
+        }
+        if replace:
+            json_msg['replace_original'] = True
+        ServerProcessor.send_response_msg(url, json_msg, ephemeral=False)
+
+    @staticmethod
+    def log_stats():
+        Coinbase.RATE_LIMITER.log_stats("Coinbase")
+        if Coinbase.CACHE is not None:
+            Coinbase.CACHE.log_stats("Coinbase")
+
     """Debug method to print body contents received"""
     @staticmethod
     def print_body_dict(body_dict: dict):
@@ -1,34 +1,46 @@
 import logging
-import requests
 import json
 
 from src.coinbase import Currency, Coinbase
 from src.stats import HourData
 from src.constants import SlackColourThresholds
+from src.http_client import HttpClient
+from src.metrics import Metrics
 
 class Slack:
     ATTACHMENT_MIN_WIDTH = 21
 
     @classmethod
     def post_to_slack(cls, name: str, icon_url: str, text: str, attachments: list, slack_url: str, channel=""):
-        slack_data = {"username": name, "icon_url": icon_url, "text": text, "attachments": attachments, "channel": channel}
+        # Imported here as importing requests is slow, and most webhook runs don't post
+        import requests
+
+        slack_data = cls.create_post_data(name, icon_url, text, attachments, channel)
         response = "null"
 
         try:
-            response = requests.post(slack_url, data=json.dumps(slack_data), headers={"content-type": "application/json"})
+            with Metrics.timer("slack_post_seconds", {'kind': "webhook"}):
+                response = HttpClient.post(slack_url, data=json.dumps(slack_data), headers={"content-type": "application/json"})
+            Metrics.increment("slack_posts_total", {'kind': "webhook", 'result': response.status_code})
             if response.status_code != requests.codes.ok:
                 cls.slack_error_msg(response, slack_data)
                 return -1
         except requests.exceptions.ConnectionError:
+            Metrics.increment("slack_posts_total", {'kind': "webhook", 'result': "connection_error"})
             logging.exception("Connection refused")
             cls.slack_error_msg(response, slack_data)
             return -1
         except Exception as e:
+            Metrics.increment("slack_posts_total", {'kind': "webhook", 'result': "error"})
             logging.exception("An exception occurred:")
             logging.exception(e)
             cls.slack_error_msg(response, slack_data)
             return -1
 
+    @staticmethod
+    def create_post_data(name: str, icon_url: str, text: str, attachments: list, channel=""):
+        return {"username": name, "icon_url": icon_url, "text": text, "attachments": attachments, "channel": channel}
+
     @classmethod
     def slack_error_msg(cls, response, slack_data):
         logging.error("An error occurred posting to slack")
@@ -49,7 +61,7 @@ class Slack:
         return attachments
 
     @classmethod
-    def generate_post(cls, prices: list, current_stats: HourData, currency: Currency):
+    def generate_post(cls, prices, current_stats: HourData, currency: Currency, store=None):
         cur_price = current_stats.cur_price
         price_1_hour = prices[1]
         price_24_hour = prices[24]
@@ -70,7 +82,7 @@ class Slack:
         # Try to add 28 day stats
         # noinspection PyBroadException
         try:
-            cb = Coinbase(currency)
+            cb = Coinbase(currency, store=store)
             price_28_days = cb.price_days_ago(28)
             attachments.append(cls.format_price_entry(cur_price, price_28_days, currency, 28, False))
         except Exception as e:
@@ -106,6 +118,19 @@ class Slack:
 
         return attachment
 
+    """Entry for a price that hasn't been retrieved (yet), in the same layout as format_price_entry"""
+    @classmethod
+    def format_missing_entry(cls, units_ago: int, hours=True, pending=True):
+        time_unit = "hour" if hours else "day"
+        if units_ago != 1:
+            time_unit += "s"
+        pretext = f"Price {units_ago} {time_unit} ago:"
+        chars_to_pad = 2 * (cls.ATTACHMENT_MIN_WIDTH - len(pretext))
+        pretext += " " * chars_to_pad
+
+        text = pretext + ("retrieving..." if pending else "unavailable")
+        return {"fallback": "some price changes", "text": text, "color": ""}
+
     @staticmethod
     def format_num(num: float):
         if num < 100:
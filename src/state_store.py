@@ -0,0 +1,74 @@
+import logging
+import json
+import time
+
+from src.database import Database
+
+"""SQLite store of the history of every script (alert), and a log of every post made
+One file can be shared by every notifier process and the watcher, updates are made in a single transaction"""
+class StateStore:
+    def __init__(self, file: str = "notifier_state.db"):
+        self.file = file
+
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS state (script_name TEXT PRIMARY KEY, pair TEXT, ema_reset INTEGER NOT NULL, "
+                       "price REAL, rising INTEGER NOT NULL, ema TEXT, updated REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS alerts (id INTEGER PRIMARY KEY AUTOINCREMENT, script_name TEXT NOT NULL, pair TEXT, "
+                       "time REAL NOT NULL, price REAL NOT NULL, rising INTEGER NOT NULL, ema REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS alerts_script ON alerts (script_name, time)")
+
+    def connect(self):
+        return Database.connect(self.file)
+
+    """History data for a script, in the same format as the json history files (None if it hasn't been saved)"""
+    def load(self, script_name: str):
+        return self.load_all([script_name]).get(script_name)
+
+    """History data for many scripts with a single query, script name -> data (scripts that haven't been saved are left out)"""
+    def load_all(self, script_names: list):
+        script_names = list(script_names)
+        data = {}
+        with self.connect() as db:
+            # SQLite limits the number of parameters in a query, so very long lists are split up
+            for i in range(0, len(script_names), 500):
+                names = script_names[i:i + 500]
+                rows = db.execute(f"SELECT script_name, ema_reset, price, rising, ema FROM state WHERE script_name IN ({', '.join('?' * len(names))})",
+                                  names)
+                for script_name, ema_reset, price, rising, ema in rows:
+                    data[script_name] = {
+                        'ema_reset': bool(ema_reset),
+                        'last_post': {'price': price, 'rising': bool(rising)},
+                        'ema': None if ema is None else json.loads(ema)
+                    }
+
+        logging.debug(f"Loaded the history of {len(data)}/{len(script_names)} scripts from {self.file}")
+        return data
+
+    """Save the history data of a script, and add any posts made to the alert log, in one transaction
+    Posts are (time, price, rising, ema) tuples"""
+    def save(self, script_name: str, pair: str, data: dict, posts: list = ()):
+        now = time.time()
+        ema = data.get('ema')
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT OR REPLACE INTO state (script_name, pair, ema_reset, price, rising, ema, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (script_name, pair, data['ema_reset'], data['last_post']['price'], data['last_post']['rising'],
+                        None if ema is None else json.dumps(ema), now))
+            db.executemany("INSERT INTO alerts (script_name, pair, time, price, rising, ema) VALUES (?, ?, ?, ?, ?, ?)",
+                           [(script_name, pair, *post) for post in posts])
+            db.execute("COMMIT")
+
+    """Posts made (newest first) as dicts, for every script or only the one given"""
+    def alerts(self, script_name: str = None, limit: int = 100):
+        query = "SELECT script_name, pair, time, price, rising, ema FROM alerts"
+        params = []
+        if script_name is not None:
+            query += " WHERE script_name = ?"
+            params.append(script_name)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+
+        with self.connect() as db:
+            rows = db.execute(query, params).fetchall()
+
+        return [{'script_name': row[0], 'pair': row[1], 'time': row[2], 'price': row[3], 'rising': bool(row[4]), 'ema': row[5]} for row in rows]
@@ -1,3 +1,5 @@
+import logging
+
 class Stats:
     @staticmethod
     def sma(data, window):
@@ -7,23 +9,83 @@ class Stats:
 
     @classmethod
     def ema(cls, data, window):
+        return cls.ema_and_sma(data, window)[0]
+
+    """EMA of the last window values (oldest first), and the SMA of the window before that which it starts from"""
+    @classmethod
+    def ema_and_sma(cls, data, window):
         if len(data) < 2 * window:
             raise ValueError("data is too short")
+        current_sma = cls.sma(data[-window * 2: -window], window)
+        return cls.ema_advance(current_sma, data[-window:], window), current_sma
+
+    """Advance an existing EMA by the new values (oldest first)"""
+    @staticmethod
+    def ema_advance(current_ema, values, window):
         c = 2.0 / (window + 1)
-        current_ema = cls.sma(data[-window * 2: -window], window)
-        for value in data[-window:]:
+        for value in values:
             current_ema = (c * value) + ((1 - c) * current_ema)
         return current_ema
 
-"""Data class to calculate stats from basic input data"""
+    """Advance an EMA and SMA from ema_and_sma by the last count values of data (oldest first), giving the same result as ema_and_sma(data)
+    Unlike ema_advance the SMA moves forward too, so the EMA stays over the same window. data must have at least 2 * window + count values"""
+    @staticmethod
+    def ema_advance_windowed(current_ema, current_sma, data, window, count: int = 1):
+        if len(data) < 2 * window + count:
+            raise ValueError("data is too short")
+
+        c = 2.0 / (window + 1)
+        sma_weight = (1 - c) ** window
+        for end in range(len(data) - count, len(data)):
+            # The price leaving the EMA joins the SMA, so the EMA drops its oldest term and the SMA's term is replaced
+            leaving = data[end - window]
+            next_sma = current_sma + (leaving - data[end - 2 * window]) / window
+            current_ema = (1 - c) * (current_ema - sma_weight * current_sma - c * (1 - c) ** (window - 1) * leaving) \
+                + c * data[end] + sma_weight * next_sma
+            current_sma = next_sma
+        return current_ema, current_sma
+
+"""Data class to calculate stats from basic input data
+If the candle times and the EMA from the last run are given, then the EMA is advanced from the last run instead of being recomputed"""
 class HourData:
-    def __init__(self, price_data, ema_num_hours, offset: int = 0):
+    def __init__(self, price_data, ema_num_hours, offset: int = 0, times: list = None, last_ema: dict = None):
         if offset > 0:
             price_data = price_data[offset:]
+            if times is not None:
+                times = times[offset:]
 
         cur_price = price_data[0]
-        ema = Stats.ema(price_data[::-1], ema_num_hours)
+        ema = None
+        if times is not None and last_ema is not None and last_ema['window'] == ema_num_hours and last_ema['time'] in times \
+                and 'sma' in last_ema and len(price_data) >= 2 * ema_num_hours + times.index(last_ema['time']):
+            # Prices are newest first, so everything before the last EMA's candle is new
+            new_candles = times.index(last_ema['time'])
+            ema, sma = Stats.ema_advance_windowed(last_ema['value'], last_ema['sma'], price_data[2 * ema_num_hours + new_candles - 1::-1],
+                                                  ema_num_hours, new_candles)
+            logging.debug(f"Advanced EMA from the last run by {new_candles} candles")
+        elif last_ema is not None:
+            logging.info("Can't advance EMA from the last run (gap in candles or EMA changed), recomputing it")
+
+        if ema is None:
+            ema, sma = Stats.ema_and_sma(price_data[::-1], ema_num_hours)
+
+        self.set_stats(cur_price, ema)
+        self.ema_state = None if times is None else {'value': ema, 'sma': sma, 'time': times[0], 'window': ema_num_hours}
+
+    """Calculate from candles (newest first), using the open prices"""
+    @classmethod
+    def from_candles(cls, candles, ema_num_hours, offset: int = 0, last_ema: dict = None):
+        return cls(candles.open, ema_num_hours, offset, candles.time, last_ema)
+
+    """Create from an EMA that has already been calculated (eg. by HourDataSeries)"""
+    @classmethod
+    def from_ema(cls, cur_price, ema):
+        stats = cls.__new__(cls)
+        stats.set_stats(cur_price, ema)
+        stats.ema_state = None
+        return stats
 
+    def set_stats(self, cur_price, ema):
         diff = cur_price - ema
         percent_diff = diff / ema
         percent_diff *= 100
@@ -0,0 +1,115 @@
+import logging
+import json
+import time
+import calendar
+
+from src.coinbase import Coinbase
+from src.history import History
+from src.notifier import AlertConfig, Notifier
+from src.stats import Stats, HourData
+from src.websocket import WebSocket
+
+"""Real time alerts from coinbase's ticker feed
+Candles are only used to bootstrap the hourly prices and EMA, after that the EMA is advanced from the ticker as each hour starts.
+Every tick (debounced) is checked against the EMA, with the tick's price as the current price"""
+class TickerStream:
+    FEED_URL = "wss://ws-feed.exchange.coinbase.com"
+    SECS_IN_HOUR = 3600
+
+    def __init__(self, config: AlertConfig, coinbase: Coinbase, feed_url: str = FEED_URL, debounce: float = 5, reconnect_delay: float = 5,
+                 history: History = None):
+        self.config = config
+        self.coinbase = coinbase
+        self.feed_url = feed_url
+        self.debounce = debounce
+        self.reconnect_delay = reconnect_delay
+
+        self.history = Notifier.load_history(config) if history is None else history
+        self.prices = []
+        self.times = []
+        self.base_ema = None
+        self.base_sma = None
+        self.last_price = None
+        self.last_evaluated = 0.0
+        self.running = False
+
+    """Get the hourly prices from candles, and the EMA up to (not including) the current hour"""
+    def bootstrap(self):
+        candles = self.coinbase.hourly_candles()
+        self.prices = list(candles.open)
+        self.times = list(candles.time)
+        self.base_ema, self.base_sma = Stats.ema_and_sma(self.prices[:0:-1], self.config.ema)
+        logging.info(f"Bootstrapped {len(self.prices)} hourly prices, EMA before the current hour is {self.base_ema:.2f}")
+
+    """Handle a price from the feed, returns whether a message was posted"""
+    def on_tick(self, price: float, timestamp: float):
+        # Roll over to a new hour, the first tick of the hour is used as the open price
+        hours_passed = int((timestamp - self.times[0]) // self.SECS_IN_HOUR)
+        if hours_passed > 1:
+            logging.info(f"Missed {hours_passed - 1} hours of ticks, bootstrapping from candles again")
+            self.bootstrap()
+        elif hours_passed == 1:
+            self.base_ema, self.base_sma = Stats.ema_advance_windowed(self.base_ema, self.base_sma, self.prices[2 * self.config.ema::-1], self.config.ema)
+            self.prices.insert(0, price)
+            self.times.insert(0, self.times[0] + self.SECS_IN_HOUR)
+            self.prices.pop()
+            self.times.pop()
+
+        if price == self.last_price or timestamp - self.last_evaluated < self.debounce:
+            return False
+        self.last_price = price
+        self.last_evaluated = timestamp
+
+        # The current price replaces the hour's open price for the checks
+        ema, _ = Stats.ema_advance_windowed(self.base_ema, self.base_sma, self.prices[2 * self.config.ema:0:-1] + [price], self.config.ema)
+        stats = HourData.from_ema(price, ema)
+        return Notifier.evaluate_stats(self.config, self.history, stats, [price] + self.prices[1:])
+
+    """Parse a ticker message, returns (price, unix timestamp) or None for other messages"""
+    @staticmethod
+    def parse_message(message: str):
+        data = json.loads(message)
+        if data.get('type') != "ticker" or 'price' not in data:
+            return None
+
+        timestamp = time.time()
+        if 'time' in data:
+            # Times are UTC, eg. 2019-03-01T12:34:56.123456Z
+            seconds, _, fraction = data['time'].rstrip("Z").partition(".")
+            timestamp = calendar.timegm(time.strptime(seconds, "%Y-%m-%dT%H:%M:%S")) + float("0." + (fraction or "0"))
+
+        return float(data['price']), timestamp
+
+    """Stream ticks until the connection drops"""
+    def stream(self):
+        ws = WebSocket(self.feed_url)
+        try:
+            ws.send_text(json.dumps({
+                "type": "subscribe",
+                "product_ids": [self.config.currency.pair],
+                "channels": ["ticker", "heartbeat"]
+            }))
+
+            while True:
+                tick = self.parse_message(ws.recv_text())
+                if tick is not None:
+                    self.on_tick(*tick)
+        finally:
+            ws.close()
+
+    """Stream ticks, reconnecting whenever the connection drops, until stop is called"""
+    def run_forever(self):
+        self.running = True
+        self.bootstrap()
+        while self.running:
+            try:
+                self.stream()
+            except (IOError, ValueError) as e:
+                if not self.running:
+                    break
+                logging.warning(f"Ticker stream stopped ({e}), reconnecting in {self.reconnect_delay} seconds")
+                time.sleep(self.reconnect_delay)
+
+    """Stop run_forever (eg. from another thread) once the current connection drops"""
+    def stop(self):
+        self.running = False
@@ -0,0 +1,79 @@
+import logging
+
+from src.stats import Stats, HourData
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""HourData for every offset of a price list at once, with the same fields as HourData but as sequences indexed by offset
+sma is the SMA that each offset's EMA starts from (the same as Stats.ema_and_sma)
+Uses numpy to calculate every EMA in one vectorised pass if it's installed, otherwise falls back to Stats.ema for each offset"""
+class HourDataSeries:
+    def __init__(self, price_data, ema_num_hours, prices_oldest_first=None):
+        self.ema_num_hours = ema_num_hours
+
+        if numpy is None:
+            self.cur_price, self.ema, self.sma = self.python_ema_series(price_data, ema_num_hours)
+            self.set_stats_python()
+            return
+
+        if prices_oldest_first is None:
+            prices_oldest_first = numpy.asarray(price_data[::-1], dtype=float)
+        self.ema, self.sma = self.numpy_ema_series(prices_oldest_first, ema_num_hours)
+        self.cur_price = prices_oldest_first[::-1][:len(self.ema)]
+
+        self.diff = self.cur_price - self.ema
+        self.ema_percent_diff = self.diff / self.ema * 100
+        self.ema_percent_diff_positive = numpy.abs(self.ema_percent_diff)
+        self.is_diff_positive = self.diff > 0
+
+    """Calculate the series for several EMA windows, only converting the price list once"""
+    @classmethod
+    def for_windows(cls, price_data, windows: list):
+        prices_oldest_first = None if numpy is None else numpy.asarray(price_data[::-1], dtype=float)
+        return {window: cls(price_data, window, prices_oldest_first) for window in windows}
+
+    def __len__(self):
+        return len(self.ema)
+
+    """HourData for a single offset"""
+    def at(self, offset: int):
+        return HourData.from_ema(float(self.cur_price[offset]), float(self.ema[offset]))
+
+    """EMA and SMA for each offset (newest first), equivalent to Stats.ema_and_sma(prices[offset:][::-1], window)
+    The EMA starts from the SMA of the window before the last window, so it's a weighted sum of the last 2 windows:
+    (1 - c)^window * SMA + sum of c * (1 - c)^i * price i candles ago"""
+    @staticmethod
+    def numpy_ema_series(prices_oldest_first, window: int):
+        if len(prices_oldest_first) < 2 * window:
+            raise ValueError("data is too short")
+
+        c = 2.0 / (window + 1)
+        cumulative = numpy.concatenate(([0.0], numpy.cumsum(prices_oldest_first)))
+        sma = (cumulative[window:-window] - cumulative[:-2 * window]) / window
+
+        weights = c * (1 - c) ** numpy.arange(window - 1, -1, -1)
+        weighted = numpy.correlate(prices_oldest_first[window:], weights, mode="valid")
+
+        # Index i is the EMA ending at price i + 2 * window - 1 (oldest first), so reverse to index by offset
+        return ((1 - c) ** window * sma + weighted)[::-1], sma[::-1]
+
+    @staticmethod
+    def python_ema_series(price_data, window: int):
+        logging.debug("numpy is not installed, calculating EMA series without it")
+        price_data = list(price_data)
+        offsets = range(len(price_data) - 2 * window + 1)
+        if len(offsets) == 0:
+            raise ValueError("data is too short")
+
+        ema_and_sma = [Stats.ema_and_sma(price_data[offset:][::-1], window) for offset in offsets]
+        return [price_data[offset] for offset in offsets], [ema for ema, _ in ema_and_sma], [sma for _, sma in ema_and_sma]
+
+    def set_stats_python(self):
+        stats = [HourData.from_ema(cur_price, ema) for cur_price, ema in zip(self.cur_price, self.ema)]
+        self.diff = [s.diff for s in stats]
+        self.ema_percent_diff = [s.ema_percent_diff for s in stats]
+        self.ema_percent_diff_positive = [s.ema_percent_diff_positive for s in stats]
+        self.is_diff_positive = [s.is_diff_positive for s in stats]
@@ -0,0 +1,82 @@
+import logging
+import json
+import time
+
+from src.coinbase import Coinbase
+from src.candle_store import CandleStore
+from src.notifier import AlertConfig, Notifier
+
+"""Long running replacement for running webhook-notifier.py from cron once per alert
+Candles are retrieved once per (pair, interval), and every alert for that pair is evaluated against them"""
+class Watcher:
+    # Seconds to wait after a candle boundary, so that coinbase has created the new candle
+    BOUNDARY_DELAY = 10
+
+    def __init__(self, configs: list, store: CandleStore = None):
+        script_names = [config.script_name for config in configs]
+        duplicates = set(name for name in script_names if script_names.count(name) > 1)
+        if len(duplicates) > 0:
+            raise ValueError(f"Script names must be unique, as they set where history is saved (duplicates: {', '.join(sorted(duplicates))})")
+
+        self.configs = configs
+        self.store = store
+
+    """Load alert configs from a json file
+    The file contains a list of alerts under 'alerts', and 'defaults' that apply to every alert (eg. the webhook url)"""
+    @staticmethod
+    def load_configs(file_name: str):
+        with open(file_name, "r") as f:
+            data = json.loads(f.read())
+
+        defaults = data.get('defaults', {})
+        return [AlertConfig.from_dict({**defaults, **alert}) for alert in data['alerts']]
+
+    """Retrieve prices and evaluate every alert once"""
+    def run_once(self):
+        groups = {}
+        for config in self.configs:
+            groups.setdefault((config.currency.pair, config.interval), []).append(config)
+
+        # The history of every alert is loaded at once (a single query with a state store)
+        histories = dict(zip((config.script_name for config in self.configs), Notifier.load_histories(self.configs)))
+
+        posted = 0
+        for (pair, interval), configs in groups.items():
+            # noinspection PyBroadException
+            try:
+                candles = Coinbase(configs[0].currency, interval, self.store).hourly_candles()
+            except Exception:
+                logging.exception(f"Could not retrieve prices for {pair}, skipping {len(configs)} alerts", exc_info=True)
+                continue
+
+            for config in configs:
+                logging.info(f"Evaluating {config.script_name} ({pair})")
+
+                # noinspection PyBroadException
+                try:
+                    if Notifier.evaluate(config, candles, histories[config.script_name]):
+                        posted += 1
+                except Exception:
+                    logging.exception(f"Exception occurred evaluating {config.script_name}", exc_info=True)
+
+        logging.info(f"Evaluated {len(self.configs)} alerts for {len(groups)} pairs, {posted} messages posted")
+        Coinbase.RATE_LIMITER.log_stats("Coinbase")
+
+    """Seconds until the next candle boundary of the smallest interval being watched"""
+    def seconds_to_next_boundary(self):
+        period = min(config.interval for config in self.configs) * Coinbase.SECS_IN_MINUTE
+        return period - time.time() % period + self.BOUNDARY_DELAY
+
+    def run_forever(self):
+        logging.info(f"Watching {len(self.configs)} alerts")
+
+        # Posts are sent in the background, so a slow or unavailable slack doesn't delay evaluating the other alerts
+        if Notifier.OUTBOX is not None:
+            Notifier.OUTBOX.start_sender()
+
+        while True:
+            self.run_once()
+
+            wait = self.seconds_to_next_boundary()
+            logging.debug(f"Sleeping for {wait:.0f} seconds until the next candle")
+            time.sleep(wait)
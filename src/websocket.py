@@ -0,0 +1,131 @@
+import logging
+import base64
+import hashlib
+import os
+import socket
+import ssl
+import struct
+import urllib.parse as urlparse
+
+class WebSocketError(IOError):
+    pass
+
+"""Minimal websocket client (RFC 6455) using only the standard library
+Supports ws:// and wss://, text messages, and answers pings. Extensions and subprotocols aren't supported"""
+class WebSocket:
+    GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    OP_CONTINUATION = 0x0
+    OP_TEXT = 0x1
+    OP_BINARY = 0x2
+    OP_CLOSE = 0x8
+    OP_PING = 0x9
+    OP_PONG = 0xA
+
+    def __init__(self, url: str, timeout: float = 30):
+        parsed = urlparse.urlparse(url)
+        secure = parsed.scheme == "wss"
+        host = parsed.hostname
+        port = parsed.port or (443 if secure else 80)
+        path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+
+        logging.info(f"Connecting to websocket {url}")
+        self.sock = socket.create_connection((host, port), timeout)
+        if secure:
+            self.sock = ssl.create_default_context().wrap_socket(self.sock, server_hostname=host)
+        self.file = self.sock.makefile("rb")
+
+        self.handshake(host, port, path)
+
+    def handshake(self, host: str, port: int, path: str):
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = f"GET {path} HTTP/1.1\r\n" \
+                  f"Host: {host}:{port}\r\n" \
+                  "Upgrade: websocket\r\n" \
+                  "Connection: Upgrade\r\n" \
+                  f"Sec-WebSocket-Key: {key}\r\n" \
+                  "Sec-WebSocket-Version: 13\r\n\r\n"
+        self.sock.sendall(request.encode())
+
+        status = self.file.readline().decode("latin-1")
+        headers = {}
+        while True:
+            line = self.file.readline().decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if " 101 " not in status:
+            raise WebSocketError(f"Websocket handshake failed: {status.strip()}")
+
+        expected = base64.b64encode(hashlib.sha1((key + self.GUID).encode()).digest()).decode()
+        if headers.get("sec-websocket-accept") != expected:
+            raise WebSocketError("Websocket handshake failed: invalid Sec-WebSocket-Accept header")
+
+    def send_text(self, text: str):
+        self.send_frame(self.OP_TEXT, text.encode("utf-8"))
+
+    """Client frames must be masked"""
+    def send_frame(self, opcode: int, payload: bytes):
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([0x80 | length])
+        elif length < 2 ** 16:
+            header += bytes([0x80 | 126]) + struct.pack("!H", length)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack("!Q", length)
+
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.sock.sendall(header + mask + masked)
+
+    """Block until the next text message, raises WebSocketError if the connection is closed"""
+    def recv_text(self):
+        message = b""
+        while True:
+            fin, opcode, payload = self.recv_frame()
+
+            if opcode == self.OP_PING:
+                self.send_frame(self.OP_PONG, payload)
+            elif opcode == self.OP_CLOSE:
+                raise WebSocketError("Websocket closed by server")
+            elif opcode in (self.OP_TEXT, self.OP_BINARY, self.OP_CONTINUATION):
+                message += payload
+                if fin:
+                    return message.decode("utf-8")
+
+    def recv_frame(self):
+        header = self.read_exact(2)
+        fin = bool(header[0] & 0x80)
+        opcode = header[0] & 0x0F
+        masked = bool(header[1] & 0x80)
+        length = header[1] & 0x7F
+
+        if length == 126:
+            length = struct.unpack("!H", self.read_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self.read_exact(8))[0]
+
+        mask = self.read_exact(4) if masked else None
+        payload = self.read_exact(length)
+        if mask is not None:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+        return fin, opcode, payload
+
+    def read_exact(self, num_bytes: int):
+        data = self.file.read(num_bytes)
+        if len(data) < num_bytes:
+            raise WebSocketError("Websocket connection lost")
+        return data
+
+    def close(self):
+        # noinspection PyBroadException
+        try:
+            self.send_frame(self.OP_CLOSE, b"")
+        except Exception:
+            pass
+        self.file.close()
+        self.sock.close()
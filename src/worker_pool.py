@@ -0,0 +1,38 @@
+import logging
+import queue
+import threading
+
+"""Fixed size pool of worker threads with a bounded job queue
+Unlike ThreadPoolExecutor, submitting to a full queue fails straight away instead of queueing without limit"""
+class WorkerPool:
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.jobs = queue.Queue(maxsize=queue_size)
+
+        for i in range(workers):
+            t = threading.Thread(target=self.worker, name=f"{name}-{i}")
+            t.daemon = True
+            t.start()
+
+        logging.debug(f"Started {workers} {name} threads (queue size {queue_size})")
+
+    """Queue a function to be called by a worker, returns False if the queue is full"""
+    def submit(self, func, *args):
+        try:
+            self.jobs.put_nowait((func, args))
+            return True
+        except queue.Full:
+            logging.warning(f"The {self.name} queue is full ({self.jobs.maxsize} jobs waiting)")
+            return False
+
+    def worker(self):
+        while True:
+            func, args = self.jobs.get()
+
+            # noinspection PyBroadException
+            try:
+                func(*args)
+            except Exception:
+                logging.exception(f"Exception occurred in {self.name} thread", exc_info=True)
+            finally:
+                self.jobs.task_done()
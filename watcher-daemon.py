@@ -0,0 +1,77 @@
+import logging
+import argparse
+import time
+
+from src.candle_store import CandleStore
+from src.coinbase import Coinbase
+from src.rate_limit import RateLimiter
+from src.logsetup import LogSetup
+from src.notifier import Notifier
+from src.outbox import Outbox
+from src.state_store import StateStore
+from src.watcher import Watcher
+
+# Constants
+LOG_LOC = "log_watcher"
+
+# Argparse
+parser = argparse.ArgumentParser(description="Continuously watch many cryptocurrency pairs and post messages to slack if any have changed price significantly")
+parser.add_argument("config",
+                    help="Json file of alerts to watch. Alerts use the same settings as webhook-notifier.py "
+                         "(pair, url, channel, name, ema, interval, threshold_ema, threshold_reset, script_name)")
+parser.add_argument("--once", action="store_true",
+                    help="Evaluate every alert once and exit instead of running continuously")
+parser.add_argument("--candle-store", "-cs", default="candle_store", type=str,
+                    help="Directory to store retrieved candles in, so that only new candles are requested from coinbase")
+parser.add_argument("--disable-candle-store", "-dcs", action="store_true",
+                    help="Retrieve the full candle window from coinbase every time instead of using the candle store")
+parser.add_argument("--disable-candle-retention", action="store_true",
+                    help="Keep every stored candle, instead of only keeping fine candles (eg. minute candles) for recent prices")
+parser.add_argument("--rate-limit-file", "-rlf", default=None, type=str,
+                    help="File used to share the coinbase rate limit with other processes using the same file (eg. other webhooks and the slash command)")
+parser.add_argument("--gap-fill", default=Coinbase.GAP_FILL, type=str, choices=Coinbase.GAP_FILLS,
+                    help="How hourly candles that coinbase doesn't return (even when requested again) are filled in: with the previous close "
+                         "('carry'), or by skipping the run ('flag')")
+parser.add_argument("--state-store", "-ss", default="notifier_state.db", type=str,
+                    help="SQLite file that the history of every script and a log of posts are saved in (existing json history files are imported)")
+parser.add_argument("--disable-state-store", "-dss", action="store_true",
+                    help="Save the history of each script in its own json file instead of the state store")
+parser.add_argument("--outbox", "-o", default="slack_outbox.db", type=str,
+                    help="SQLite file that posts are queued in until slack accepts them")
+parser.add_argument("--disable-outbox", "-do", action="store_true",
+                    help="Post straight to slack instead of queueing posts (posts that fail are not retried)")
+parser.add_argument("--log-file", "-lf", action="store_true",
+                    help=f"Output logs into files in /{LOG_LOC}")
+parser.add_argument("--disable-stdout", "-dso", action="store_true",
+                    help="Disable log messages lower than ERROR from appearing in stdout")
+parser.add_argument("--disable-stderr", "-dse", action="store_true",
+                    help="Disable error messages from appearing in stdout (requires --disable-stdout to also be set)")
+parser.add_argument("--log-level", "-ll", default="DEBUG", type=str, choices=["DEBUG", "INFO", "WARN", "ERROR"],
+                    help="Lowest level of log messages to output (messages below it are dropped before they're formatted)")
+parser.add_argument("--log-rotation", default="size", type=str, choices=LogSetup.ROTATIONS,
+                    help=f"Rotate log files when they reach {LogSetup.MAX_BYTES // (1024 * 1024)}MB ('size') or at midnight ('daily'), "
+                         f"keeping {LogSetup.BACKUP_COUNT} old files, or create a new file every run ('none')")
+parser.add_argument("--disable-log-queue", action="store_true",
+                    help="Format and write log messages in the thread logging them, instead of a separate logging thread")
+args = parser.parse_args()
+
+# Setup and run
+LogSetup.setup(not args.disable_stdout, not args.disable_stderr, args.log_file, LOG_LOC,
+               getattr(logging, args.log_level), not args.disable_log_queue, args.log_rotation)
+
+Coinbase.RATE_LIMITER = RateLimiter(state_file=args.rate_limit_file)
+Coinbase.GAP_FILL = args.gap_fill
+candle_store = None if args.disable_candle_store else CandleStore(args.candle_store, retention=None if args.disable_candle_retention else CandleStore.RETENTION)
+Notifier.CANDLE_STORE = candle_store
+if not args.disable_outbox:
+    Notifier.OUTBOX = Outbox(args.outbox)
+if not args.disable_state_store:
+    Notifier.STATE_STORE = StateStore(args.state_store)
+
+watcher = Watcher(Watcher.load_configs(args.config), candle_store)
+if args.once:
+    watcher.run_once()
+    if Notifier.OUTBOX is not None:
+        Notifier.OUTBOX.flush(time.time() + 60)
+else:
+    watcher.run_forever()
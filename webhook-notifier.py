@@ -1,14 +1,16 @@
 import logging
 import argparse
 import sys
+import time
 
-from src.history import History
-from src.analysis import Analysis
-from src.coinbase import Coinbase, Currencies
+from src.coinbase import CandleGapError, Coinbase, Currencies
+from src.candle_store import CandleStore
 from src.logsetup import LogSetup
-from src.slack import Slack
-from src.stats import HourData
-from src.constants import SlackImages
+from src.metrics import Metrics
+from src.notifier import AlertConfig, Notifier
+from src.outbox import Outbox
+from src.state_store import StateStore
+from src.rate_limit import RateLimiter
 
 # region Argparse and logging
 parser = argparse.ArgumentParser(description="Post messages to slack if a cryptocurrency has changed price significantly")
@@ -29,60 +31,104 @@ parser.add_argument("--threshold-reset", "-tr", default=1.25, type=float,
 parser.add_argument("--script-name", "-sn", default="default", type=str,
                     help="Name of the script. Changes the name of json file and log location (use this if you're running the script multiple"
                          "times with different parameters)")
+parser.add_argument("--candle-store", "-cs", default="candle_store", type=str,
+                    help="Directory to store retrieved candles in, so that only new candles are requested from coinbase")
+parser.add_argument("--disable-candle-store", "-dcs", action="store_true",
+                    help="Retrieve the full candle window from coinbase every run instead of using the candle store")
+parser.add_argument("--disable-candle-retention", action="store_true",
+                    help="Keep every stored candle, instead of only keeping fine candles (eg. minute candles) for recent prices")
+parser.add_argument("--max-age", "-ma", default=0, type=float,
+                    help="Seconds that stored candles are up to date for. Runs within this time of the last request use the candle store "
+                         "without making any requests to coinbase (0 always requests the newest candles)")
+parser.add_argument("--rate-limit-file", "-rlf", default=None, type=str,
+                    help="File used to share the coinbase rate limit with other processes using the same file (eg. other webhooks and the slash command)")
+parser.add_argument("--gap-fill", default=Coinbase.GAP_FILL, type=str, choices=Coinbase.GAP_FILLS,
+                    help="How hourly candles that coinbase doesn't return (even when requested again) are filled in: with the previous close "
+                         "('carry'), or by skipping the run ('flag')")
+parser.add_argument("--state-store", "-ss", default="notifier_state.db", type=str,
+                    help="SQLite file that the history of every script and a log of posts are saved in (existing json history files are imported)")
+parser.add_argument("--disable-state-store", "-dss", action="store_true",
+                    help="Save the history of each script in its own json file instead of the state store")
+parser.add_argument("--outbox", "-o", default="slack_outbox.db", type=str,
+                    help="SQLite file that posts are queued in until slack accepts them (shared with other webhooks using the same file)")
+parser.add_argument("--disable-outbox", "-do", action="store_true",
+                    help="Post straight to slack instead of queueing posts (posts that fail are not retried)")
+parser.add_argument("--flush-timeout", default=20, type=float,
+                    help="Seconds to spend posting queued messages (including ones that failed on previous runs) before exiting")
+parser.add_argument("--stream", action="store_true",
+                    help="Run continuously, checking every price from coinbase's ticker feed instead of only the hourly candles")
+parser.add_argument("--feed-url", default="wss://ws-feed.exchange.coinbase.com", type=str,
+                    help="Websocket url of the ticker feed (used with --stream)")
+parser.add_argument("--debounce", default=5, type=float,
+                    help="Minimum seconds between checks of the ticker price (used with --stream)")
+parser.add_argument("--api-url", default=Coinbase.API_URL, type=str,
+                    help="Base url of the coinbase API (eg. a local server for testing)")
+parser.add_argument("--metrics-file", "-mf", default=None, type=str,
+                    help="File to write request counts and timings to at the end of the run (Prometheus text format)")
 parser.add_argument("--log-file", "-lf", action="store_true",
                     help=f"Output logs into files (stored in separate log directory per script name)")
 parser.add_argument("--disable-stdout", "-dso", action="store_true",
                     help="Disable log messages lower than ERROR from appearing in stdout")
 parser.add_argument("--disable-stderr", "-dse", action="store_true",
                     help="Disable error messages from appearing in stdout (requires --disable-stdout to also be set)")
+parser.add_argument("--log-level", "-ll", default="DEBUG", type=str, choices=["DEBUG", "INFO", "WARN", "ERROR"],
+                    help="Lowest level of log messages to output (messages below it are dropped before they're formatted)")
+parser.add_argument("--log-rotation", default="size", type=str, choices=LogSetup.ROTATIONS,
+                    help=f"Rotate log files when they reach {LogSetup.MAX_BYTES // (1024 * 1024)}MB ('size') or at midnight ('daily'), "
+                         f"keeping {LogSetup.BACKUP_COUNT} old files, or create a new file every run ('none')")
+parser.add_argument("--disable-log-queue", action="store_true",
+                    help="Format and write log messages in the thread logging them, instead of a separate logging thread")
 args = parser.parse_args()
 
 if len(args.script_name) < 1:
     parser.error("Script name must be at least 1 character long")
 
-LogSetup.setup(not args.disable_stdout, not args.disable_stderr, args.log_file, f"log_webhook/{args.script_name}")
-# endregion
-
-# region Constants
-# Configurable Constants
-EMA_THRESHOLD_PERCENT = args.threshold_ema
-EMA_NUM_HOURS = args.ema
-EMA_RESET_PERCENT = args.threshold_reset
-
-BOT_NAME = args.name
-SLACK_CHANNEL = args.channel
-
-# 'Hard' Constants - may rely on other values set but shouldn't be changed
-SLACK_URL = args.url
-DATA_FILE = f"last_post_data_{args.script_name}.json"
+LogSetup.setup(not args.disable_stdout, not args.disable_stderr, args.log_file, f"log_webhook/{args.script_name}",
+               getattr(logging, args.log_level), not args.disable_log_queue, args.log_rotation)
 # endregion
 
 # Get data and convert accordingly
-cb = Coinbase(Currencies.default(), args.interval)
-prices = cb.price_list()
-cur_price = prices[0]
+run_start = time.perf_counter()
+config = AlertConfig(args.url, Currencies.default(), args.channel, args.name, args.ema, args.interval,
+                     args.threshold_ema, args.threshold_reset, args.script_name)
+Coinbase.API_URL = args.api_url
+Coinbase.RATE_LIMITER = RateLimiter(state_file=args.rate_limit_file)
+Coinbase.GAP_FILL = args.gap_fill
+candle_store = None if args.disable_candle_store else CandleStore(args.candle_store, args.max_age, None if args.disable_candle_retention else CandleStore.RETENTION)
+Notifier.CANDLE_STORE = candle_store
+cb = Coinbase(config.currency, config.interval, candle_store)
+if not args.disable_outbox:
+    Notifier.OUTBOX = Outbox(args.outbox)
+if not args.disable_state_store:
+    Notifier.STATE_STORE = StateStore(args.state_store)
 
-# Get history from last runs, use it to work out what test to make
-history = History(DATA_FILE)
+if args.stream:
+    # Only imported when streaming, to keep the start up of normal (cron) runs fast
+    from src.streaming import TickerStream
+    if Notifier.OUTBOX is not None:
+        Notifier.OUTBOX.start_sender()
+    TickerStream(config, cb, args.feed_url, args.debounce).run_forever()
 
-# Get stats from coinbase data
-# If change isn't large enough, then update history and exit
-stats = HourData(prices, EMA_NUM_HOURS)
-if Analysis.ema_checks(stats, history, EMA_THRESHOLD_PERCENT, EMA_RESET_PERCENT):
-    sys.exit(1)
+# Missing candles would shift the prices used, so the run is skipped if they're flagged (queued posts are still sent)
+try:
+    candles = cb.hourly_candles()
+except CandleGapError as e:
+    logging.error(f"{e}, skipping this run")
+    candles = None
+Coinbase.RATE_LIMITER.log_stats("Coinbase")
 
-if not Analysis.should_post(history, stats, prices, EMA_THRESHOLD_PERCENT):
-    sys.exit(1)
+posted = candles is not None and Notifier.evaluate(config, candles)
+Metrics.observe("notifier_run_seconds", time.perf_counter() - run_start)
 
-logging.info("Message should be posted, generating attachment")
-attachments = Slack.generate_post(prices, stats, Currencies.default())
-image_url = SlackImages.get_image(stats.is_diff_positive)
-logging.info("Posting to slack")
-Slack.post_to_slack(BOT_NAME, image_url, "", attachments, SLACK_URL, SLACK_CHANNEL)
+# Send the queued posts, any that fail are retried on later runs
+if Notifier.OUTBOX is not None:
+    sent = Notifier.OUTBOX.flush(time.time() + args.flush_timeout)
+    logging.info(f"Posted {sent} queued messages to slack, {Notifier.OUTBOX.pending()} still queued")
+if args.metrics_file is not None:
+    Metrics.write(args.metrics_file)
 
-history.price = stats.cur_price
-history.rising = stats.is_diff_positive
-history.ema_reset = False
-history.save()
+# Exit with 1 if no message was posted
+if not posted:
+    sys.exit(1)
 
 logging.info("Done")